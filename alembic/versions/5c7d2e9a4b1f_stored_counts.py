@@ -0,0 +1,39 @@
+"""Stored counts of menus and submenus
+
+Revision ID: 5c7d2e9a4b1f
+Revises: 8e2b4c1d9f3a
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5c7d2e9a4b1f'
+down_revision = '8e2b4c1d9f3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('menu', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('submenus_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('dishes_count', sa.Integer(), server_default='0', nullable=False))
+    with op.batch_alter_table('submenu', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dishes_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute('UPDATE submenu SET dishes_count = '
+               '(SELECT count(dish.id) FROM dish WHERE dish.submenu_id = submenu.id)')
+    op.execute('UPDATE menu SET submenus_count = '
+               '(SELECT count(submenu.id) FROM submenu WHERE submenu.menu_id = menu.id), '
+               'dishes_count = '
+               '(SELECT count(dish.id) FROM dish JOIN submenu ON dish.submenu_id = submenu.id '
+               'WHERE submenu.menu_id = menu.id)')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('submenu', schema=None) as batch_op:
+        batch_op.drop_column('dishes_count')
+    with op.batch_alter_table('menu', schema=None) as batch_op:
+        batch_op.drop_column('dishes_count')
+        batch_op.drop_column('submenus_count')
@@ -0,0 +1,24 @@
+"""Dish (submenu_id, id) index
+
+Revision ID: 8e2b4c1d9f3a
+Revises: 31438175f0bd
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8e2b4c1d9f3a'
+down_revision = '31438175f0bd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('dish', schema=None) as batch_op:
+        batch_op.create_index('ix_dish_submenu_id_id', ['submenu_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('dish', schema=None) as batch_op:
+        batch_op.drop_index('ix_dish_submenu_id_id')
@@ -0,0 +1,30 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Query
+
+from app import schemas
+from app.core import settings
+from app.services import catalogue_service
+
+router = APIRouter(prefix=settings.URL_PREFIX.rstrip('/'), tags=['Catalogue'])
+
+SUM_VERSION = 'Текущая версия каталога.'
+SUM_CHANGES = 'ID меню, подменю и блюд, измененных и удаленных после версии `since`.'
+
+
+@router.get(
+    '/version',
+    response_model=schemas.CatalogueVersion,
+    summary=SUM_VERSION,
+    description=(f'{settings.ALL_USERS} {SUM_VERSION}'))
+async def get_version_(catalogue_service: catalogue_service):
+    return await catalogue_service.get_version()
+
+
+@router.get(
+    '/changes',
+    response_model=schemas.CatalogueChanges,
+    summary=SUM_CHANGES,
+    description=(f'{settings.ALL_USERS} {SUM_CHANGES}'))
+async def get_changes_(catalogue_service: catalogue_service, since: Annotated[int, Query(ge=0)]):
+    return await catalogue_service.get_changes(since)
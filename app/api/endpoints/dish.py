@@ -3,7 +3,7 @@ from fastapi import APIRouter
 from app import schemas
 from app.api.endpoints import utils as u
 from app.core import settings
-from app.services import dish_service, submenu_service
+from app.services import dish_service, response_cache, submenu_service
 
 router = APIRouter(prefix=f'{settings.URL_PREFIX}menus', tags=['Dishes'])
 
@@ -20,9 +20,12 @@ SUM_DELETE_ITEM = u.SUM_DELETE_ITEM.format(NAME)
     response_model=list[schemas.DishOut],
     summary=SUM_ALL_ITEMS,
     description=(f'{settings.ALL_USERS} {SUM_ALL_ITEMS}'))
-async def get_all_(submenu_id: int, submenu_service: submenu_service):
-    submenu = await submenu_service.get(submenu_id)  # type: ignore
-    return [] if submenu is None else submenu.dishes  # type: ignore
+async def get_all_(menu_id: int, submenu_id: int, dish_service: dish_service, response_cache: response_cache,
+                   page: u.page):
+    if (response := await response_cache.get('dish')) is not None:
+        return response
+    dishes, next_cursor = await dish_service.get_page(parent_id=(menu_id, submenu_id), **page)
+    return await response_cache.set(dishes, list[schemas.DishOut], u.next_cursor_header(next_cursor))
 
 
 @router.post(
@@ -35,8 +38,8 @@ async def create_(submenu_id: int,
                   payload: schemas.DishIn,
                   submenu_service: submenu_service,
                   dish_service: dish_service):
-    submenu = await submenu_service.get_or_404(submenu_id)
-    return await dish_service.create(payload, extra_data=submenu.id)
+    await submenu_service.get_or_404(submenu_id)
+    return await dish_service.create(payload, extra_data=submenu_id)
 
 
 @router.get(
@@ -44,8 +47,10 @@ async def create_(submenu_id: int,
     response_model=schemas.DishOut,
     summary=SUM_ITEM,
     description=(f'{settings.ALL_USERS} {SUM_ITEM}'))
-async def get_(item_id: int, dish_service: dish_service):
-    return await dish_service.get_or_404(item_id)
+async def get_(item_id: int, dish_service: dish_service, response_cache: response_cache):
+    if (response := await response_cache.get('dish')) is not None:
+        return response
+    return await response_cache.set(await dish_service.get_or_404(item_id), schemas.DishOut)
 
 
 @router.patch(
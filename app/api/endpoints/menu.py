@@ -1,10 +1,12 @@
-from fastapi import APIRouter
-from fastapi.encoders import jsonable_encoder
+from typing import Annotated
+
+from fastapi import APIRouter, Header, Response
+from fastapi.responses import StreamingResponse
 
 from app import schemas
 from app.api.endpoints import utils as u
 from app.core import settings
-from app.services import menu_service
+from app.services import catalogue_service, menu_service, response_cache
 
 router = APIRouter(prefix=f'{settings.URL_PREFIX}menus', tags=['Menus'])
 
@@ -14,7 +16,8 @@ SUM_ITEM = u.SUM_ITEM.format(NAME)
 SUM_CREATE_ITEM = u.SUM_CREATE_ITEM.format(NAME)
 SUM_UPDATE_ITEM = u.SUM_UPDATE_ITEM.format(NAME)
 SUM_DELETE_ITEM = u.SUM_DELETE_ITEM.format(NAME)
-SUM_FULL_LIST = f'Полный список {NAME}.'
+SUM_FULL_LIST = f'Полный список {NAME} с подменю и блюдами.'
+SUM_STREAM = f'Поток изменений {NAME}, подменю и блюд (server-sent events).'
 
 
 @router.get(
@@ -22,9 +25,11 @@ SUM_FULL_LIST = f'Полный список {NAME}.'
     response_model=list[schemas.MenuOut],
     summary=SUM_ALL_ITEMS,
     description=(f'{settings.ALL_USERS} {SUM_ALL_ITEMS}'))
-async def get_all_(menu_service: menu_service):
-    menus = await menu_service.get_all()
-    return [] if menus is None else menus
+async def get_all_(menu_service: menu_service, response_cache: response_cache, page: u.page):
+    if (response := await response_cache.get('menu')) is not None:
+        return response
+    menus, next_cursor = await menu_service.get_page(**page)
+    return await response_cache.set(menus, list[schemas.MenuOut], u.next_cursor_header(next_cursor))
 
 
 @router.get(
@@ -32,9 +37,11 @@ async def get_all_(menu_service: menu_service):
     response_model=list[dict],
     summary=SUM_FULL_LIST,
     description=(f'{settings.SUPER_ONLY} {SUM_FULL_LIST}'))
-async def get_full_list(menu_service: menu_service):
-    menus = await menu_service.get_all()
-    return [] if menus is None else [jsonable_encoder(m) for m in menus]
+async def get_full_list(menu_service: menu_service, response_cache: response_cache):
+    etag, body = await menu_service.get_tree()
+    if (response := response_cache.not_modified(etag)) is not None:
+        return response
+    return Response(body, headers=response_cache.headers, media_type=response_cache.MEDIA_TYPE)
 
 
 @router.post(
@@ -47,13 +54,25 @@ async def create_(payload: schemas.MenuIn, menu_service: menu_service):
     return await menu_service.create(payload)
 
 
+@router.get(
+    '/stream',
+    response_class=StreamingResponse,
+    summary=SUM_STREAM,
+    description=(f'{settings.ALL_USERS} {SUM_STREAM}'))
+async def stream_(catalogue_service: catalogue_service, last_event_id: Annotated[int | None, Header(ge=0)] = None):
+    return StreamingResponse(await catalogue_service.stream(last_event_id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @router.get(
     '/{item_id}',
     response_model=schemas.MenuOut,
     summary=SUM_ITEM,
     description=(f'{settings.ALL_USERS} {SUM_ITEM}'))
-async def get_(item_id: int, menu_service: menu_service):
-    return await menu_service.get_or_404(item_id)
+async def get_(item_id: int, menu_service: menu_service, response_cache: response_cache):
+    if (response := await response_cache.get('menu')) is not None:
+        return response
+    return await response_cache.set(await menu_service.get_or_404(item_id), schemas.MenuOut)
 
 
 @router.patch(
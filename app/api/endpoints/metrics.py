@@ -0,0 +1,39 @@
+from fastapi import APIRouter
+
+from app.core import get_redis_pool_stats, settings
+from app.repositories.redis_repository import REDIS_STATS
+from app.services.services import change_stream, local_cache
+
+router = APIRouter(prefix=f'{settings.URL_PREFIX}metrics', tags=['Metrics'])
+
+SUM_REDIS_POOL = 'Статистика пула соединений Redis.'
+SUM_CACHE = 'Попадания и промахи кеша процесса (L1) и Redis.'
+SUM_STREAM = 'Подписчики потока изменений в процессе и их буферизованные события.'
+
+
+@router.get(
+    '/redis-pool',
+    response_model=dict[str, int],
+    summary=SUM_REDIS_POOL,
+    description=(f'{settings.SUPER_ONLY} {SUM_REDIS_POOL}'))
+async def get_redis_pool_stats_():
+    return get_redis_pool_stats()
+
+
+@router.get(
+    '/cache',
+    response_model=dict[str, int],
+    summary=SUM_CACHE,
+    description=(f'{settings.SUPER_ONLY} {SUM_CACHE}'))
+async def get_cache_stats_():
+    return {**local_cache.stats(), 'redis_hits': REDIS_STATS['redis_hits'],
+            'redis_misses': REDIS_STATS['redis_misses']}
+
+
+@router.get(
+    '/stream',
+    response_model=dict[str, int],
+    summary=SUM_STREAM,
+    description=(f'{settings.SUPER_ONLY} {SUM_STREAM}'))
+async def get_stream_stats_():
+    return change_stream.stats()
@@ -3,7 +3,7 @@ from fastapi import APIRouter
 from app import schemas
 from app.api.endpoints import utils as u
 from app.core import settings
-from app.services import menu_service, submenu_service
+from app.services import menu_service, response_cache, submenu_service
 
 router = APIRouter(prefix=f'{settings.URL_PREFIX}menus', tags=['Submenus'])
 
@@ -20,9 +20,11 @@ SUM_DELETE_ITEM = u.SUM_DELETE_ITEM.format(NAME)
     response_model=list[schemas.SubmenuOut],
     summary=SUM_ALL_ITEMS,
     description=(f'{settings.ALL_USERS} {SUM_ALL_ITEMS}'))
-async def get_all_(menu_id: int, menu_service: menu_service):
-    menu = await menu_service.get(menu_id)  # type: ignore
-    return [] if menu is None else menu.submenus  # type: ignore
+async def get_all_(menu_id: int, submenu_service: submenu_service, response_cache: response_cache, page: u.page):
+    if (response := await response_cache.get('submenu')) is not None:
+        return response
+    submenus, next_cursor = await submenu_service.get_page(parent_id=(menu_id,), **page)
+    return await response_cache.set(submenus, list[schemas.SubmenuOut], u.next_cursor_header(next_cursor))
 
 
 @router.post(
@@ -35,8 +37,8 @@ async def create_(menu_id: int,
                   payload: schemas.SubmenuIn,
                   menu_service: menu_service,
                   submenu_service: submenu_service):
-    menu = await menu_service.get_or_404(menu_id)
-    return await submenu_service.create(payload, extra_data=menu.id)
+    await menu_service.get_or_404(menu_id)
+    return await submenu_service.create(payload, extra_data=menu_id)
 
 
 @router.get(
@@ -44,8 +46,10 @@ async def create_(menu_id: int,
     response_model=schemas.SubmenuOut,
     summary=SUM_ITEM,
     description=(f'{settings.ALL_USERS} {SUM_ITEM}'))
-async def get_(item_id: int, submenu_service: submenu_service):
-    return await submenu_service.get_or_404(item_id)
+async def get_(item_id: int, submenu_service: submenu_service, response_cache: response_cache):
+    if (response := await response_cache.get('submenu')) is not None:
+        return response
+    return await response_cache.set(await submenu_service.get_or_404(item_id), schemas.SubmenuOut)
 
 
 @router.patch(
@@ -1,3 +1,9 @@
+from typing import Annotated
+
+from fastapi import Depends, Query
+
+from app.core import settings
+
 SUM_ALL_ITEMS = 'Выдача списка {}'
 SUM_ITEM = 'Возвращает {} по ID'
 SUM_CREATE_ITEM = 'Создание нового {}'
@@ -7,3 +13,20 @@ SUM_DELETE_ITEM = 'Удаление {}'
 
 def delete_response(item_name: str) -> str:
     return {'status': True, 'message': f'The {item_name} has been deleted'}
+
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def page_params(limit: Annotated[int, Query(ge=1, le=settings.page_size_max)] = settings.page_size_max,
+                after: Annotated[int | None, Query(ge=0)] = None) -> dict:
+    """Keyset pagination: `after` is the last id of the previous page,
+    the cursor of the next page is sent in the `X-Next-Cursor` header."""
+    return {'limit': limit, 'after': after}
+
+
+def next_cursor_header(next_cursor: int | None) -> dict[str, str]:
+    return {} if next_cursor is None else {NEXT_CURSOR_HEADER: str(next_cursor)}
+
+
+page = Annotated[dict, Depends(page_params)]
@@ -1,13 +1,15 @@
 from fastapi import APIRouter
 
-from app.api.endpoints import dish, menu, submenu
+from app.api.endpoints import catalogue, dish, menu, metrics, submenu
 
 main_router = APIRouter()
 
 
 for router in (
+    catalogue.router,
     dish.router,
     menu.router,
+    metrics.router,
     submenu.router,
 ):
     main_router.include_router(router)
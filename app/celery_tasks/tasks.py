@@ -1,22 +1,91 @@
 from pathlib import Path
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession
 import asyncio
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
 from app.celery_tasks.celery_app import app as celery
-from app.core import AsyncSessionLocal, engine
+from app.core import AsyncSessionLocal, close_redis_pool, engine, settings
 from app.celery_tasks import utils as u
 
+# the event loop of the worker process: the DB engine pool and the Redis pool
+# are bound to it and reused by every task run
+loop: asyncio.AbstractEventLoop | None = None
 
-async def task(session: AsyncSession = AsyncSessionLocal(),
+
+@worker_process_init.connect
+def init_worker(**kwargs) -> None:
+    global loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+
+async def close_worker() -> None:
+    await engine.dispose()
+    await close_redis_pool()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def shutdown_worker(**kwargs) -> None:
+    global loop
+    if loop is not None:
+        loop.run_until_complete(close_worker())
+        loop.close()
+        asyncio.set_event_loop(None)
+        loop = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """The solo and threads pools do not send `worker_process_init`."""
+    if loop is None:
+        init_worker()
+    return loop  # type: ignore
+
+
+async def task(session: AsyncSession | None = None,
                fname: Path = u.FILE_PATH,
-               engine: AsyncEngine = engine,
-               redis: u.aioredis.Redis = u.get_aioredis()) -> str | list:
-    if not u.is_modified(fname):
+               redis: u.aioredis.Redis | None = None,
+               warm_up: bool = settings.cache_warm_up) -> str | dict | None:
+    """Every run gets a fresh session unless `session` is given.
+    The cache is warmed up after a synchronization if `warm_up=True`."""
+    if session is None:
+        async with AsyncSessionLocal() as session:
+            return await task(session, fname, redis, warm_up)
+    redis = redis or u.get_aioredis()
+    result = await u.init_repos(session, fname, redis)
+    if result is None:
         return 'Меню не изменялось. Выход из фоновой задачи...'
-    result = await u.init_repos(session, fname, engine, redis)
-    await session.close()
+    if warm_up:
+        result['warm_up_seconds'] = (await u.warm_up_cache(session, redis))['seconds']
     return result
 
 
+async def warm_up_task(session: AsyncSession | None = None,
+                       redis: u.aioredis.Redis | None = None) -> dict:
+    if session is None:
+        async with AsyncSessionLocal() as session:
+            return await warm_up_task(session, redis)
+    return await u.warm_up_cache(session, redis or u.get_aioredis())
+
+
+async def reconcile_task(session: AsyncSession | None = None,
+                         redis: u.aioredis.Redis | None = None) -> dict:
+    if session is None:
+        async with AsyncSessionLocal() as session:
+            return await reconcile_task(session, redis)
+    return await u.reconcile_counters(session, redis or u.get_aioredis())
+
+
 @celery.task
 def synchronize():
-    return asyncio.get_event_loop().run_until_complete(task())
+    return get_loop().run_until_complete(task())
+
+
+@celery.task
+def warm_up():
+    return get_loop().run_until_complete(warm_up_task())
+
+
+@celery.task
+def reconcile():
+    """`celery -A app.celery_tasks.celery_app call app.celery_tasks.tasks.reconcile`"""
+    return get_loop().run_until_complete(reconcile_task())
@@ -1,80 +1,330 @@
-from datetime import datetime as dt
+import hashlib
+import logging
 from pathlib import Path
+from time import perf_counter
+from typing import Any, Iterable, Iterator
 import aioredis
+import orjson
 from openpyxl import load_workbook
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
-from app.core import db_flush, engine, get_aioredis, settings
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from app.core import get_aioredis, settings
+from app.models import Menu, Submenu
+from app.repositories import MenuRepository
+from app.repositories.redis_repository import RedisLock
 from app.schemas import DishIn, MenuIn, SubmenuIn
-from app.services import DishService, MenuService, SubmenuService
+from app.services import ENTITIES, DishService, MenuService, SubmenuService
 
 
 FILE_PATH = Path('admin/Menu.xlsx')
-TIME_INTERVAL = settings.celery_task_period
-
-
-def read_file(fname: str) -> tuple[list[dict]]:
-    wb = load_workbook(filename=fname)
-    ws = wb['Лист1']
-    menus, submenus, dishes = [], [], []
-    for row in ws.values:
-        if row[0] is not None:
-            menu = {}
-            menu['title'] = row[1]
-            menu['description'] = row[2]
-            menu['submenus'] = []
-            menus.append(menu)
-        elif row[1] is not None:
-            submenu = {}
-            submenu['title'] = row[2]
-            submenu['description'] = row[3]
-            submenu['dishes'] = []
-            menus[-1]['submenus'].append(submenu)
-            submenus.append(submenu)
+# hashes of the last synchronized sheet
+FILE_HASH_KEY = 'sync:file_hash'
+CONTENT_HASH_KEY = 'sync:content_hash'
+STARTUP_LOCK_KEY = 'sync:startup_lock'
+# taken by the application startup and the Celery task alike
+SYNC_LOCK_KEY = 'sync:lock'
+
+logger = logging.getLogger(__name__)
+
+
+def iter_records(fname: Path) -> Iterator[tuple[tuple[str, ...], dict]]:
+    """Streams the sheet in read-only mode and yields `(key, record)`, where `key`
+    is the path of titles: `(menu,)`, `(menu, submenu)` or `(menu, submenu, dish)`.
+    Raises ValueError if a submenu or dish row is not preceded by its parent."""
+    # the titles (cell values) of the current menu and submenu
+    menu: Any = None
+    submenu: Any = None
+    wb = load_workbook(filename=fname, read_only=True)
+    try:
+        for number, row in enumerate(wb['Лист1'].iter_rows(values_only=True), 1):
+            row = (*row, *(None,) * (6 - len(row)))
+            if row[0] is not None:
+                menu, submenu = row[1], None
+                yield (menu,), {'title': row[1], 'description': row[2]}
+            elif row[1] is not None:
+                if menu is None:
+                    raise ValueError(f'Row {number}: the submenu has no menu.')
+                submenu = row[2]
+                yield (menu, submenu), {'title': row[2], 'description': row[3]}
+            elif any(row):
+                if submenu is None:
+                    raise ValueError(f'Row {number}: the dish has no submenu.')
+                yield (menu, submenu, row[3]), {'title': row[3], 'description': row[4], 'price': row[5]}
+    finally:
+        wb.close()
+
+
+def read_file(fname: Path) -> tuple[list[dict], list[dict], list[dict]]:
+    menus: list[dict] = []
+    submenus: list[dict] = []
+    dishes: list[dict] = []
+    for key, record in iter_records(fname):
+        if len(key) == 1:
+            menus.append({**record, 'submenus': []})
+        elif len(key) == 2:
+            submenus.append({**record, 'dishes': []})
+            menus[-1]['submenus'].append(submenus[-1])
         else:
-            dish = {}
-            dish['title'] = row[3]
-            dish['description'] = row[4]
-            dish['price'] = row[5]
-            menus[-1]['submenus'][-1]['dishes'].append(dish)
-            dishes.append(dish)
+            dishes.append(record)
+            menus[-1]['submenus'][-1]['dishes'].append(record)
     return menus, submenus, dishes
 
 
-def is_modified(fname: str) -> bool:
-    mod_time = dt.fromtimestamp(fname.stat().st_mtime)
-    return (dt.now() - mod_time).total_seconds() <= TIME_INTERVAL
+def iter_tree(menus: list[dict]) -> Iterator[tuple[tuple[str, ...], dict]]:
+    """`iter_records` of the menus parsed by `read_file`."""
+    for menu in menus:
+        yield (menu['title'],), menu
+        for submenu in menu.get('submenus') or ():
+            yield (menu['title'], submenu['title']), submenu
+            for dish in submenu.get('dishes') or ():
+                yield (menu['title'], submenu['title'], dish['title']), dish
+
+
+def get_file_hash(fname: Path) -> str:
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_content_hash(records: Iterable[tuple[tuple[str, ...], dict]]) -> str:
+    """Hash of the rows in their order, indifferent to the file format details
+    (a sheet saved again without changes has other bytes but the same content)."""
+    digest = hashlib.sha256()
+    for record in records:
+        digest.update(hashlib.sha256(orjson.dumps(record, option=orjson.OPT_SORT_KEYS)).digest())
+    return digest.hexdigest()
 
 
 async def fill_repos(menus: list[dict],
                      menu_service: MenuService,
                      submenu_service: SubmenuService,
-                     dish_service: DishService) -> None:
-    for menu in menus:
-        created_menu = await menu_service.db.create(MenuIn(title=menu['title'], description=menu['description']))
-        submenus = menu.get('submenus')
-        if submenus:
-            for submenu in submenus:
-                created_submenu = await submenu_service.db.create(
-                    SubmenuIn(title=submenu['title'], description=submenu['description']), extra_data=created_menu.id)
-                dishes = submenu.get('dishes')
-                if dishes:
-                    for dish in dishes:
-                        await dish_service.db.create(
-                            DishIn(title=dish['title'],
-                                   description=dish['description'], price=dish['price']), extra_data=created_submenu.id)
+                     dish_service: DishService) -> dict | None:
+    """Imports the menus parsed by `read_file`."""
+    return await sync_repos(iter_tree(menus), menu_service, submenu_service, dish_service)
+
+
+def _diff(old: dict, new: dict, fields: tuple[str, ...]) -> tuple[list, list, list]:
+    """Keys of the created objects, the updated objects (changed in place) and the deleted objects."""
+    created = [key for key in new if key not in old]
+    updated = []
+    for key, obj in old.items():
+        if key in new and any(getattr(obj, field) != new[key][field] for field in fields):
+            for field in fields:
+                setattr(obj, field, new[key][field])
+            updated.append(obj)
+    deleted = [obj for key, obj in old.items() if key not in new]
+    return created, updated, deleted
+
+
+async def _set_cache(services: tuple[MenuService, SubmenuService, DishService],
+                     deleted: tuple[list, list, list], ids: tuple[set[int], set[int], set[int]]) -> None:
+    """Writes the objects of `ids` (the changed ones and the parents with changed counts)
+    and deletes the `deleted` ones along with their children in one batch, so a synchronization
+    is one catalogue version and one event however many objects it has changed."""
+    deleted_menus, deleted_submenus, deleted_dishes = deleted
+    deleted_submenus = [*deleted_submenus, *(submenu for menu in deleted_menus for submenu in menu.submenus)]
+    deleted_dishes = [*deleted_dishes, *(dish for submenu in deleted_submenus for dish in submenu.dishes)]
+    # one query per level, with the state committed by the synchronization
+    objs = [await service.db.get_many(service_ids, populate_existing=True)
+            for service, service_ids in zip(services, ids)]
+    await services[0]._cache_batch(
+        set=tuple((service.redis, service_objs) for service, service_objs in zip(services, objs)),
+        delete=tuple((service.redis, service_objs) for service, service_objs in zip(
+            services, (deleted_menus, deleted_submenus, deleted_dishes))))
+
+
+async def sync_repos(records: Iterable[tuple[tuple[str, ...], dict]],
+                     menu_service: MenuService,
+                     submenu_service: SubmenuService,
+                     dish_service: DishService) -> dict | None:
+    """Diffs the `iter_records` of the sheet against the DB and applies only the changes
+    in one transaction (created objects are bulk inserted level by level
+    and the counts of their parents are recounted),
+    then the changed objects are written to the cache in one batch.
+    Objects are keyed by their titles along with the titles of their parents,
+    so an object moved to another parent is deleted and created again.
+    An empty sheet is ignored rather than taken for deleting the whole menu."""
+    start = perf_counter()
+    new: tuple[dict[tuple[str, ...], dict], ...] = ({}, {}, {})
+    new_menus, new_submenus, new_dishes = new
+    for key, record in records:
+        new[len(key) - 1][key] = (MenuIn, SubmenuIn, DishIn)[len(key) - 1](**record).dict()
+    if not new_menus:
+        return None
+    session = menu_service.db.session
+    db_menus = await menu_service.db.get_all(
+        options=(selectinload(Menu.submenus).selectinload(Submenu.dishes),)) or []
+    old_menus = {(menu.title,): menu for menu in db_menus}
+    old_submenus = {(menu.title, submenu.title): submenu for menu in db_menus for submenu in menu.submenus}
+    old_dishes = {(*key, dish.title): dish for key, submenu in old_submenus.items() for dish in submenu.dishes}
+    # the menu keys the cached lists of a deleted dish, it is known from the tree
+    for submenu in old_submenus.values():
+        for dish in submenu.dishes:
+            set_committed_value(dish, 'menu_id', submenu.menu_id)
+    created_menus, updated_menus, deleted_menus = _diff(old_menus, new_menus, ('description',))
+    created_submenus, updated_submenus, deleted_submenus = _diff(
+        old_submenus, new_submenus, ('description',))
+    created_dishes, updated_dishes, deleted_dishes = _diff(old_dishes, new_dishes, ('description', 'price'))
+    # the children of a deleted parent are deleted by the cascade
+    deleted_ids = {menu.id for menu in deleted_menus}
+    deleted_submenus = [submenu for submenu in deleted_submenus if submenu.menu_id not in deleted_ids]
+    deleted_ids = {submenu.id for menu in deleted_menus for submenu in menu.submenus}
+    deleted_ids.update(submenu.id for submenu in deleted_submenus)
+    deleted_dishes = [dish for dish in deleted_dishes if dish.submenu_id not in deleted_ids]
+    try:
+        for obj in (*deleted_menus, *deleted_submenus, *deleted_dishes):
+            await session.delete(obj)
+        # the titles of the deleted objects may be taken by the created ones
+        await session.flush()
+        menu_ids: dict[tuple[str, ...], int] = {key: menu.id for key, menu in old_menus.items()}
+        menu_ids.update(zip(created_menus, await menu_service.db.bulk_create(
+            [new_menus[key] for key in created_menus])))
+        submenu_rows = [new_submenus[key] for key in created_submenus]
+        for row, key in zip(submenu_rows, created_submenus):
+            submenu_service.db.perform_create(row, menu_ids[key[:1]])
+        submenu_ids: dict[tuple[str, ...], int] = {key: submenu.id for key, submenu in old_submenus.items()}
+        submenu_ids.update(zip(created_submenus, await submenu_service.db.bulk_create(submenu_rows)))
+        dish_rows = [new_dishes[key] for key in created_dishes]
+        for row, key in zip(dish_rows, created_dishes):
+            dish_service.db.perform_create(row, submenu_ids[key[:2]])
+        dish_ids = await dish_service.db.bulk_create(dish_rows)
+        # the counts stored by the parents of the created and deleted objects
+        recounted_submenu_ids = {*(submenu_ids[key[:2]] for key in created_dishes),
+                                 *(dish.submenu_id for dish in deleted_dishes)}
+        recounted_menu_ids = {*(menu_ids[key[:1]] for key in (*created_submenus, *created_dishes)),
+                              *(obj.menu_id for obj in (*deleted_submenus, *deleted_dishes))}
+        await submenu_service.db.recount(recounted_submenu_ids)
+        await menu_service.db.recount(recounted_menu_ids)
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    # nothing of an empty DB can be cached
+    if db_menus:
+        await _set_cache((menu_service, submenu_service, dish_service),
+                         (deleted_menus, deleted_submenus, deleted_dishes),
+                         ({*(menu.id for menu in updated_menus), *(menu_ids[key] for key in created_menus),
+                           *recounted_menu_ids},
+                          {*(submenu.id for submenu in updated_submenus),
+                           *(submenu_ids[key] for key in created_submenus), *recounted_submenu_ids},
+                          {*(dish.id for dish in updated_dishes), *dish_ids}))
+    elif created_menus:
+        # nothing has been cached but the responses and the menus tree
+        await menu_service._cache_batch(changed=ENTITIES)
+    seconds = perf_counter() - start
+    rows = len(new_menus) + len(new_submenus) + len(new_dishes)
+    stats = {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else rows,
+             'created': len(created_menus) + len(created_submenus) + len(created_dishes),
+             'updated': len(updated_menus) + len(updated_submenus) + len(updated_dishes),
+             'deleted': len(deleted_menus) + len(deleted_submenus) + len(deleted_dishes)}
+    logger.info('Synchronized %(rows)d rows in %(seconds).3f s (%(rows_per_sec).0f rows/sec): '
+                '%(created)d created, %(updated)d updated, %(deleted)d deleted', stats)
+    return stats
 
 
 async def init_repos(session: AsyncSession,
                      fname: Path = FILE_PATH,
-                     engine: AsyncEngine = engine,
-                     redis: aioredis.Redis = get_aioredis()) -> list:
-    menus, _, _ = read_file(fname)
-    if not menus:
+                     redis: aioredis.Redis | None = None,
+                     force: bool = False) -> dict | None:
+    """Returns None if the sheet has not changed since the last synchronization
+    (unless `force=True`). The file hash is checked first, so an unchanged file
+    is not parsed; a changed file is parsed once more to learn whether its content
+    has changed too. Returns None at once if another process holds the sync lock,
+    so two processes never insert the same objects."""
+    redis = redis or get_aioredis()
+    lock = RedisLock(redis, SYNC_LOCK_KEY, settings.sync_lock_timeout)
+    if not await lock.acquire():
+        logger.info('Synchronization is run by another process')
+        return None
+    try:
+        file_hash, content_hash = await redis.mget(FILE_HASH_KEY, CONTENT_HASH_KEY)
+        new_file_hash = get_file_hash(fname)
+        if not force and file_hash is not None and file_hash.decode() == new_file_hash:
+            return None
+        new_content_hash = get_content_hash(iter_records(fname))
+        stats = None
+        if force or content_hash is None or content_hash.decode() != new_content_hash:
+            stats = await sync_repos(iter_records(fname),
+                                     MenuService(session, redis, None),
+                                     SubmenuService(session, redis, None),
+                                     DishService(session, redis, None))
+        await redis.mset({FILE_HASH_KEY: new_file_hash, CONTENT_HASH_KEY: new_content_hash})
+        return stats
+    finally:
+        await lock.release()
+
+
+async def warm_up_cache(session: AsyncSession, redis: aioredis.Redis) -> dict:
+    """Writes all the menus, submenus and dishes with their complete lists
+    (the whole ones and the ones of every parent) in one pipeline and builds
+    the menus tree, so the first clients after a synchronization do not miss the cache.
+    The data is not changed, so neither are the versions nor the cached responses."""
+    start = perf_counter()
+    services = (MenuService(session, redis, None), SubmenuService(session, redis, None),
+                DishService(session, redis, None))
+    stats: dict = {}
+    async with services[0].redis.pipeline() as pipe:
+        for name, service in zip(('menus', 'submenus', 'dishes'), services):
+            objs = await service.db.get_all(options=service.read_options) or []
+            await service.redis.set_all_with_parents(objs, pipe)
+            stats[name] = len(objs)
+        await pipe.execute()
+    await services[0].get_tree()
+    stats['seconds'] = perf_counter() - start
+    logger.info('Warmed up the cache with %(menus)d menus, %(submenus)d submenus, '
+                '%(dishes)d dishes in %(seconds).3f s', stats)
+    return stats
+
+
+async def reconcile_counters(session: AsyncSession, redis: aioredis.Redis) -> dict:
+    """Verifies the counts stored by the menus and submenus against the actual ones,
+    repairs the drifted ones and refreshes them in the cache."""
+    menu_service, submenu_service = MenuService(session, redis, None), SubmenuService(session, redis, None)
+    try:
+        submenu_ids = await submenu_service.db.recount()
+        menu_ids = await menu_service.db.recount()
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    stats = {'menus': len(menu_ids), 'submenus': len(submenu_ids)}
+    if not menu_ids and not submenu_ids:
+        return stats
+    menus = await menu_service.db.get_many(menu_ids, populate_existing=True)
+    submenus = await submenu_service.db.get_many(submenu_ids, populate_existing=True)
+    await menu_service._cache_batch(set=((menu_service.redis, menus), (submenu_service.redis, submenus)))
+    logger.warning('Repaired the counts of %(menus)d menus and %(submenus)d submenus', stats)
+    return stats
+
+
+async def startup_repos(session: AsyncSession,
+                        redis: aioredis.Redis,
+                        mode: str = settings.startup_mode,
+                        fname: Path = FILE_PATH,
+                        warm_up: bool = settings.cache_warm_up) -> dict | None:
+    """Synchronizes the sheet on application startup without dropping the tables:
+    `none` - does nothing, `verify` - only if the sheet has changed or there are
+    no menus in the DB (a recreated DB against the hashes kept by Redis),
+    `seed-if-empty` - only if there are no menus in the DB,
+    `full-reload` - even if the sheet has not changed.
+    The cache is warmed up afterwards if `warm_up=True`.
+    Only the worker that takes the lock does it, the others start serving at once."""
+    if mode == 'none':
+        return None
+    lock = RedisLock(redis, STARTUP_LOCK_KEY, settings.startup_lock_timeout)
+    if not await lock.acquire():
+        logger.info('Startup synchronization is run by another worker')
         return None
-    await redis.flushall()
-    await db_flush(engine)
-    await fill_repos(menus,
-                     MenuService(session, redis, None),
-                     SubmenuService(session, redis, None),
-                     DishService(session, redis, None))
-    return menus
+    try:
+        stats = None
+        empty = await MenuRepository(session).get_all(limit=1) is None
+        if mode != 'seed-if-empty' or empty:
+            stats = await init_repos(session, fname, redis=redis, force=mode != 'verify' or empty)
+        if warm_up:
+            await warm_up_cache(session, redis)
+        return stats
+    finally:
+        await lock.release()
@@ -1,2 +1,12 @@
 from .config import settings  # noqa
-from .db import AsyncSessionLocal, Base, db_flush, engine, get_async_session, get_aioredis  # noqa
+from .db import (  # noqa
+    AsyncSessionLocal,
+    Base,
+    close_redis_pool,
+    db_flush,
+    engine,
+    get_aioredis,
+    get_async_session,
+    get_redis_pool,
+    get_redis_pool_stats,
+)
@@ -40,6 +40,7 @@ class Base(DeclarativeBase):
 
 engine = create_async_engine(settings.database_url)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+redis_pool: aioredis.ConnectionPool | None = None
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
@@ -47,8 +48,39 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
         yield async_session
 
 
+def get_redis_pool() -> aioredis.ConnectionPool:
+    """Returns the process-wide connection pool, creating it on first use."""
+    global redis_pool
+    if redis_pool is None:
+        redis_pool = aioredis.ConnectionPool.from_url(
+            settings.redis_url,
+            max_connections=settings.redis_max_connections,
+            health_check_interval=settings.redis_health_check_interval,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
+        )
+    return redis_pool
+
+
+async def close_redis_pool() -> None:
+    global redis_pool
+    if redis_pool is not None:
+        await redis_pool.disconnect()
+        redis_pool = None
+
+
+def get_redis_pool_stats() -> dict[str, int]:
+    pool = get_redis_pool()
+    return {
+        'max_connections': pool.max_connections,
+        'created_connections': pool._created_connections,
+        'in_use_connections': len(pool._in_use_connections),
+        'available_connections': len(pool._available_connections),
+    }
+
+
 def get_aioredis() -> aioredis.Redis:
-    return aioredis.from_url(settings.redis_url)
+    return aioredis.Redis(connection_pool=get_redis_pool())
 
 
 async def db_flush(engine: AsyncEngine = engine) -> None:
@@ -1,8 +1,11 @@
+import asyncio
+
 from fastapi import FastAPI
 
 from app.api import main_router
-from app.core import AsyncSessionLocal, settings
-from app.celery_tasks.utils import init_repos
+from app.core import AsyncSessionLocal, close_redis_pool, get_aioredis, get_redis_pool, settings
+from app.celery_tasks.utils import startup_repos
+from app.services.services import change_stream, local_cache
 
 app = FastAPI(
     title=settings.app_title,
@@ -14,5 +17,17 @@ app.include_router(main_router)
 
 @app.on_event('startup')
 async def startup():
+    get_redis_pool()
+    if settings.local_cache:
+        app.state.local_cache_listener = asyncio.create_task(local_cache.listen(get_aioredis()))
     async with AsyncSessionLocal() as async_session:
-        await init_repos(async_session)
+        await startup_repos(async_session, get_aioredis())
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    listener = getattr(app.state, 'local_cache_listener', None)
+    if listener is not None:
+        listener.cancel()
+    await change_stream.close()
+    await close_redis_pool()
@@ -1,25 +1,19 @@
-from sqlalchemy import ForeignKey
-from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column, query_expression, relationship
 
 from app.core import Base
 
 
 class Menu(Base):
+    # the counts are stored and kept by the repositories and the importer
+    submenus_count: Mapped[int] = mapped_column(default=0, server_default='0')
+    dishes_count: Mapped[int] = mapped_column(default=0, server_default='0')
     submenus: Mapped[list['Submenu']] = relationship(
         back_populates='menu',
         cascade='all, delete-orphan',
-        lazy='selectin',
+        lazy='raise_on_sql',
     )
 
-    @hybrid_property
-    def submenus_count(self) -> int:
-        return len(self.submenus)
-
-    @hybrid_property
-    def dishes_count(self) -> int:
-        return sum(submenu.dishes_count for submenu in self.submenus)
-
     def __repr__(self) -> str:
         return (f'{super().__repr__()}'
                 f'submenus_count: {self.submenus_count}\n'
@@ -28,25 +22,28 @@ class Menu(Base):
 
 class Submenu(Base):
     menu_id: Mapped[int] = mapped_column(ForeignKey('menu.id'))
+    dishes_count: Mapped[int] = mapped_column(default=0, server_default='0')
     menu: Mapped['Menu'] = relationship(back_populates='submenus')
     dishes: Mapped[list['Dish']] = relationship(
         back_populates='submenu',
         cascade='all, delete-orphan',
-        lazy='selectin',
+        lazy='raise_on_sql',
     )
 
-    @hybrid_property
-    def dishes_count(self) -> int:
-        return len(self.dishes)
-
     def __repr__(self) -> str:
         return f'{super().__repr__()}dishes_count: {self.dishes_count}.\n'
 
 
 class Dish(Base):
+    # dishes of a submenu are listed ordered by id (keyset pages)
+    __table_args__ = (Index('ix_dish_submenu_id_id', 'submenu_id', 'id'),)
+
     price: Mapped[float] = mapped_column(default=0)
     submenu_id: Mapped[int] = mapped_column(ForeignKey('submenu.id'))
     submenu: Mapped['Submenu'] = relationship(back_populates='dishes')
+    # The menu of the dish is needed to key the cached dish lists by menu and submenu.
+    # It is not stored: the queries of `DishRepository` fill it.
+    menu_id: Mapped[int] = query_expression()
 
     def __repr__(self) -> str:
         return f'{super().__repr__()}price: {self.price}.\n'
@@ -1,13 +1,15 @@
-from typing import Any, Generic, TypeVar
+from typing import Any, Generic, Iterable, Sequence, TypeVar
 
 from fastapi import HTTPException, status
 from pydantic import BaseModel
-from sqlalchemy import exc, select
+from sqlalchemy import Executable, Select, bindparam, exc, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.base import ExecutableOption
 
 from app.core import Base
 
 ModelType = TypeVar('ModelType', bound=Base)
+LoaderOptions = Sequence[ExecutableOption]
 CreateSchemaType = TypeVar('CreateSchemaType', bound=BaseModel)
 UpdateSchemaType = TypeVar('UpdateSchemaType', bound=BaseModel)
 
@@ -18,6 +20,9 @@ class CRUDBaseRepository(
     """Базовый класс для CRUD операций произвольных моделей."""
     OBJECT_ALREADY_EXISTS = 'Object with such a unique values already exists.'
     NOT_FOUND = 'Object(s) not found.'
+    # queries by attributes are built once per model and attribute names,
+    # the values are sent as bound parameters
+    _queries: dict[tuple, Select] = {}
 
     def __init__(self,
                  model: type[ModelType],
@@ -30,43 +35,94 @@ class CRUDBaseRepository(
     def set_order_by(self, attr) -> None:
         pass
 
+    def _select(self) -> Select:
+        """The query the reads of the objects start from."""
+        return select(self.model)
+
+    def _get_query(self, attrs: tuple[str, ...]) -> Select:
+        key = (self.model, attrs)
+        query = self._queries.get(key)
+        if query is None:
+            query = (self._select()
+                     .where(*(getattr(self.model, attr) == bindparam(attr) for attr in attrs))
+                     .order_by(self.order_by))
+            self._queries[key] = query
+        return query
+
     async def __get_by_attributes(
-        self, *, all: bool = False, **kwargs,
+        self, *, all: bool = False, populate_existing: bool = False, options: LoaderOptions = (),
+        limit: int | None = None, after: int | None = None, **kwargs,
     ) -> list[ModelType] | ModelType | None:
-        query = (select(self.model).filter_by(**kwargs) if kwargs
-                 else select(self.model))
-        result = await self.session.scalars(query.order_by(self.order_by))
+        """`populate_existing=True` overwrites objects already present in the session
+           with the fresh state from the DB (e.g. recalculated counts).
+           `options` are loader options (noload/selectinload/joinedload/load_only...) for this query only.
+           `limit` and `after` select a keyset page: at most `limit` objects with id > `after`."""
+        query = self._get_query(tuple(kwargs))
+        if options:
+            query = query.options(*options)
+        if after is not None:
+            query = query.where(self.model.id > after)
+        if limit is not None:
+            query = query.limit(limit)
+        if populate_existing:
+            query = query.execution_options(populate_existing=True)
+        result = await self.session.scalars(query, kwargs or None)
         return result.all() if all else result.first()
 
-    async def _get_all_by_attrs(self, *, exception: bool = False, **kwargs
+    async def _get_all_by_attrs(self, *, exception: bool = False, options: LoaderOptions = (),
+                                limit: int | None = None, after: int | None = None, **kwargs
                                 ) -> list[ModelType] | None:
         """Raises `NOT_FOUND` exception if
            no objects are found and `exception=True`
            else returns None else returns list of found objects."""
-        objects = await self.__get_by_attributes(all=True, **kwargs)
+        objects = await self.__get_by_attributes(all=True, options=options, limit=limit, after=after, **kwargs)
         if not objects:
             if exception:
                 raise HTTPException(status.HTTP_404_NOT_FOUND, self.NOT_FOUND)
             return None
         return objects
 
-    async def _get_by_attrs(self, *, exception: bool = False, **kwargs
-                            ) -> ModelType | None:
+    async def _get_by_attrs(self, *, exception: bool = False, populate_existing: bool = False,
+                            options: LoaderOptions = (), **kwargs) -> ModelType | None:
         """Raises `NOT_FOUND` exception if
            no object is found and `exception=True`."""
-        object = await self.__get_by_attributes(**kwargs)
+        object = await self.__get_by_attributes(populate_existing=populate_existing, options=options, **kwargs)
         if object is None and exception:
             raise HTTPException(status.HTTP_404_NOT_FOUND, self.NOT_FOUND)
         return object  # type: ignore
 
-    async def get(self, pk: int) -> ModelType | None:
-        return await self._get_by_attrs(id=pk)
-
-    async def get_or_404(self, pk: int) -> ModelType:
-        return await self._get_by_attrs(id=pk, exception=True)  # type: ignore
-
-    async def get_all(self, exception: bool = False) -> list[ModelType] | None:
-        return await self._get_all_by_attrs(exception=exception)
+    async def get(self, pk: int, populate_existing: bool = False, options: LoaderOptions = ()
+                  ) -> ModelType | None:
+        """An object already present in the session is taken from the identity map
+           without a query unless `populate_existing=True` or `options` are given,
+           as the object in the session may have been loaded without them."""
+        return await self.session.get(self.model, pk, options=options,
+                                      populate_existing=populate_existing or bool(options))
+
+    async def get_or_404(self, pk: int, populate_existing: bool = False, options: LoaderOptions = ()
+                         ) -> ModelType:
+        object = await self.get(pk, populate_existing, options)
+        if object is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, self.NOT_FOUND)
+        return object
+
+    async def get_many(self, ids: Iterable[int], populate_existing: bool = False,
+                       options: LoaderOptions = ()) -> list[ModelType]:
+        """The objects of `ids` ordered by id in one query (none if `ids` are empty)."""
+        ids = list(ids)
+        if not ids:
+            return []
+        query = self._select().where(self.model.id.in_(ids)).order_by(self.order_by)
+        if options:
+            query = query.options(*options)
+        if populate_existing:
+            query = query.execution_options(populate_existing=True)
+        return list((await self.session.scalars(query)).all())
+
+    async def get_all(self, exception: bool = False, options: LoaderOptions = (),
+                      limit: int | None = None, after: int | None = None, **kwargs) -> list[ModelType] | None:
+        """`kwargs` filter the list by attributes, e.g. `menu_id=1`."""
+        return await self._get_all_by_attrs(exception=exception, options=options, limit=limit, after=after, **kwargs)
 
 # === Create, Update, Delete ===
     def has_permission(self, obj: ModelType, user: Any | None) -> None:
@@ -97,11 +153,19 @@ class CRUDBaseRepository(
         """Modify update_data here if necessary and return updated object."""
         raise NotImplementedError('perform_update() must be implemented.')
 
-    async def _save(self, obj: ModelType) -> ModelType:
-        """Tries to write object to DB. Raises `BAD_REQUEST` exception
+    def counter_updates(self, obj: ModelType, delta: int) -> list[Executable]:
+        """Override to return the UPDATEs of the counters stored by the parents,
+           they are run in the transaction that creates (`delta=1`)
+           or deletes (`delta=-1`) the object."""
+        return []
+
+    async def _save(self, obj: ModelType, statements: list[Executable] = ()) -> ModelType:  # type: ignore
+        """Tries to write object to DB along with `statements`. Raises `BAD_REQUEST` exception
            if object already exists in DB. """
         self.session.add(obj)
         try:
+            for statement in statements:
+                await self.session.execute(statement)
             await self.session.commit()
         except exc.IntegrityError:
             await self.session.rollback()
@@ -117,7 +181,20 @@ class CRUDBaseRepository(
         create_data = payload.dict()
         if extra_data is not None:
             self.perform_create(create_data, extra_data)
-        return await self._save(self.model(**create_data))
+        obj = self.model(**create_data)
+        return await self._save(obj, self.counter_updates(obj, 1))
+
+    async def bulk_create(self, rows: list[dict]) -> list[int]:
+        """Inserts `rows` with one executemany INSERT ... RETURNING within
+           the current transaction (the caller commits) and returns the ids
+           in the order of `rows`. The ids are matched by the unique titles:
+           asking the DB for the order of RETURNING splits the batch
+           into one INSERT per row on some backends (SQLite)."""
+        if not rows:
+            return []
+        query = insert(self.model).returning(self.model.title, self.model.id)
+        ids = dict((await self.session.execute(query, rows)).tuples().all())
+        return [ids[row['title']] for row in rows]
 
     async def update(
         self,
@@ -126,6 +203,7 @@ class CRUDBaseRepository(
         *,
         user: Any | None = None,
         perform_update: bool = False,
+        options: LoaderOptions = (),
     ) -> ModelType:
         """perform_update method is called if perform_update=True
            else the object is updated as follows:
@@ -134,7 +212,7 @@ class CRUDBaseRepository(
                 setattr(obj, key, value)
             ```
         """
-        obj = await self.get_or_404(pk)
+        obj = await self.get_or_404(pk, options=options)
         if user is not None:
             self.has_permission(obj, user)
         update_data = payload.dict(exclude_unset=True,
@@ -148,11 +226,15 @@ class CRUDBaseRepository(
                 setattr(obj, key, value)
         return await self._save(obj)
 
-    async def delete(self, pk: int, user: Any | None = None) -> ModelType:
-        obj = await self.get_or_404(pk)
+    async def delete(self, pk: int, user: Any | None = None, options: LoaderOptions = ()) -> ModelType:
+        """`options` should load whatever the delete cascade needs,
+           otherwise it is lazy loaded one collection at a time."""
+        obj = await self.get_or_404(pk, options=options)
         if user is not None:
             self.has_permission(obj, user)
         self.is_delete_allowed(obj)
         await self.session.delete(obj)
+        for statement in self.counter_updates(obj, -1):
+            await self.session.execute(statement)
         await self.session.commit()
         return obj
@@ -1,8 +1,18 @@
+from typing import Iterable
+
+from sqlalchemy import Executable, Row, Select, func, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import with_expression
 
 from app.models import Dish, Menu, Submenu
 
-from .base_db_repository import CRUDBaseRepository
+from .base_db_repository import CRUDBaseRepository, LoaderOptions
+
+# the menu of a dish read by itself, the lists of dishes take it from the joined submenu
+DISH_MENU_ID = (select(Submenu.menu_id)
+                .where(Submenu.id == Dish.submenu_id)
+                .correlate_except(Submenu)
+                .scalar_subquery())
 
 
 class CRUDRepository(CRUDBaseRepository):
@@ -21,6 +31,35 @@ class MenuRepository(CRUDRepository):
     def __init__(self, session: AsyncSession):
         super().__init__(Menu, session)
 
+    async def get_tree_rows(self) -> list[Row]:
+        """Menus, submenus and dishes flattened by one outer join, ordered by menu, submenu and dish."""
+        query = (select(Menu.id.label('menu_id'), Menu.title.label('menu_title'),
+                        Menu.description.label('menu_description'),
+                        Submenu.id.label('submenu_id'), Submenu.title.label('submenu_title'),
+                        Submenu.description.label('submenu_description'),
+                        Dish.id.label('dish_id'), Dish.title.label('dish_title'),
+                        Dish.description.label('dish_description'), Dish.price.label('dish_price'))
+                 .outerjoin(Submenu, Submenu.menu_id == Menu.id)
+                 .outerjoin(Dish, Dish.submenu_id == Submenu.id)
+                 .order_by(Menu.id, Submenu.id, Dish.id))
+        return list((await self.session.execute(query)).all())
+
+    async def recount(self, ids: Iterable[int] | None = None) -> list[int]:
+        """Sets the stored counts of the menus (of all if `ids` is None) to the actual ones
+           and returns the ids of the menus whose counts have drifted."""
+        submenus_count = select(func.count(Submenu.id)).where(Submenu.menu_id == Menu.id).scalar_subquery()
+        dishes_count = (select(func.count(Dish.id))
+                        .join(Submenu, Dish.submenu_id == Submenu.id)
+                        .where(Submenu.menu_id == Menu.id)
+                        .scalar_subquery())
+        query = (update(Menu)
+                 .where(or_(Menu.submenus_count != submenus_count, Menu.dishes_count != dishes_count))
+                 .values(submenus_count=submenus_count, dishes_count=dishes_count)
+                 .returning(Menu.id))
+        if ids is not None:
+            query = query.where(Menu.id.in_(ids))
+        return list((await self.session.scalars(query)).all())
+
 
 class SubmenuRepository(CRUDRepository):
     NOT_FOUND = 'submenu not found'
@@ -32,6 +71,24 @@ class SubmenuRepository(CRUDRepository):
     def perform_create(self, create_data: dict, menu_id: int) -> None:  # type: ignore
         create_data['menu_id'] = menu_id
 
+    def counter_updates(self, submenu: Submenu, delta: int) -> list[Executable]:  # type: ignore [override]
+        return [update(Menu)
+                .where(Menu.id == submenu.menu_id)
+                .values(submenus_count=Menu.submenus_count + delta,
+                        dishes_count=Menu.dishes_count + delta * (submenu.dishes_count or 0))]
+
+    async def recount(self, ids: Iterable[int] | None = None) -> list[int]:
+        """Sets the stored counts of the submenus (of all if `ids` is None) to the actual ones
+           and returns the ids of the submenus whose counts have drifted."""
+        dishes_count = select(func.count(Dish.id)).where(Dish.submenu_id == Submenu.id).scalar_subquery()
+        query = (update(Submenu)
+                 .where(Submenu.dishes_count != dishes_count)
+                 .values(dishes_count=dishes_count)
+                 .returning(Submenu.id))
+        if ids is not None:
+            query = query.where(Submenu.id.in_(ids))
+        return list((await self.session.scalars(query)).all())
+
 
 class DishRepository(CRUDRepository):
     NOT_FOUND = 'dish not found'
@@ -42,3 +99,32 @@ class DishRepository(CRUDRepository):
 
     def perform_create(self, create_data: dict, submenu_id: int) -> None:  # type: ignore
         create_data['submenu_id'] = submenu_id
+
+    def _select(self) -> Select:
+        return (select(Dish)
+                .join(Submenu, Dish.submenu_id == Submenu.id)
+                .options(with_expression(Dish.menu_id, Submenu.menu_id)))
+
+    async def get(self, pk: int, populate_existing: bool = False, options: LoaderOptions = ()
+                  ) -> Dish | None:
+        return await super().get(pk, populate_existing, (*options, with_expression(Dish.menu_id, DISH_MENU_ID)))
+
+    def counter_updates(self, dish: Dish, delta: int) -> list[Executable]:  # type: ignore [override]
+        return [update(Submenu)
+                .where(Submenu.id == dish.submenu_id)
+                .values(dishes_count=Submenu.dishes_count + delta),
+                update(Menu)
+                .where(Menu.id == select(Submenu.menu_id).where(Submenu.id == dish.submenu_id).scalar_subquery())
+                .values(dishes_count=Menu.dishes_count + delta)]
+
+    async def list_by_submenu(self, submenu_id: int, menu_id: int, limit: int | None = None,
+                              after: int | None = None, options: LoaderOptions = ()) -> list[Dish] | None:
+        """Dishes of the submenu if it belongs to the menu, checked within the same query."""
+        query = self._select().where(Dish.submenu_id == submenu_id, Submenu.menu_id == menu_id)
+        if options:
+            query = query.options(*options)
+        if after is not None:
+            query = query.where(Dish.id > after)
+        if limit is not None:
+            query = query.limit(limit)
+        return (await self.session.scalars(query.order_by(Dish.id))).all() or None
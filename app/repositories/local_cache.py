@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import AsyncIterator
+
+from aioredis import Redis
+from aioredis.client import PubSub
+
+INVALIDATE_CHANNEL = 'cache:invalidate'
+# a read of a subscription waits this long and is repeated, so it is not cut
+# by the socket timeout of the pool
+PUBSUB_POLL_TIMEOUT = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+async def iter_messages(pubsub: PubSub) -> AsyncIterator[bytes]:
+    """The data of the messages received by `pubsub`. Unlike `PubSub.listen`,
+       a silent channel is not taken for a broken connection."""
+    while True:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=PUBSUB_POLL_TIMEOUT)
+        if message is not None and message['type'] == 'message':
+            yield message['data']
+
+
+class LocalCache:
+    """Per-process LRU cache of raw Redis values in front of Redis, bounded by
+       the number of entries and their total size in bytes. Entries expire after
+       `ttl` seconds, which also bounds how long a missed invalidation lasts.
+       Keys changed by any process are published to `INVALIDATE_CHANNEL`
+       and dropped by `listen` in every process."""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 1 << 24, ttl: float = 5) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= monotonic():
+            self._pop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: bytes) -> None:
+        self._pop(key)
+        if len(value) > self.max_bytes:
+            return
+        self.entries[key] = (monotonic() + self.ttl, value)
+        self.size += len(value)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self._pop(next(iter(self.entries)))
+
+    def _pop(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def delete(self, keys: list[str]) -> None:
+        for key in keys:
+            self._pop(key)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {'l1_entries': len(self.entries), 'l1_bytes': self.size,
+                'l1_hits': self.hits, 'l1_misses': self.misses}
+
+    async def listen(self, redis: Redis) -> None:
+        """Drops the keys published to `INVALIDATE_CHANNEL` until cancelled.
+           The cache is cleared on every (re)subscription, as messages may have been missed."""
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATE_CHANNEL)
+                    self.clear()
+                    async for data in iter_messages(pubsub):
+                        self.delete(data.decode().split())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Cache invalidation listener failed, resubscribing')
+                self.clear()
+                await asyncio.sleep(1)
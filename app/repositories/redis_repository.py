@@ -1,54 +1,406 @@
-import pickle
-from typing import Any
+import random
+from bisect import bisect_right
+from collections import Counter
+from time import time, time_ns
+from typing import Any, cast
+from uuid import uuid4
 
-from aioredis import Redis
+import orjson
+from aioredis import Redis, WatchError
+from aioredis.client import Pipeline
+from redis.exceptions import WatchError as RedisWatchError  # type: ignore [import]
 
 from .base_db_repository import ModelType
+from .local_cache import INVALIDATE_CHANNEL, LocalCache
+from .serializers import PickleSerializer, Serializer
 
-serializer = pickle
+# hits and misses of the reads that went to Redis, per process
+REDIS_STATS: Counter[str] = Counter()
+# raised by aioredis and by the clients built on redis-py (fakeredis)
+WATCH_ERRORS = (WatchError, RedisWatchError)
 
 
 class RedisBaseRepository:
+    """Objects are stored under `<prefix><id>` and their ids are kept in
+       the `<prefix>index` sorted set (scored by id) so that the whole list
+       is served by one ZRANGE and one MGET instead of KEYS.
+       If `parent_attrs` are given (e.g. `('menu_id',)`) the ids are also kept in
+       the `<prefix>index:<parent ids>` sorted set of the parent's children.
+       Every expiry is lengthened by a random part of `redis_expire` up to
+       `expire_jitter`, so keys cached at once do not expire at once.
+       Every value is prefixed with the time of its soft expiry (`soft_expire`
+       seconds after it is cached, 0 if `soft_expire=0`): an object past it is
+       still served until `redis_expire` but is reported stale.
+       With `local_cache` the values and the whole indexes are read through
+       the per-process cache. Every write publishes the changed keys
+       to `INVALIDATE_CHANNEL`, so the local caches of all processes drop them."""
+    INDEX_KEY = 'index'
+    INDEX_COMPLETE = '*'
 
     def __init__(self,
                  redis: Redis,
                  redis_key_prefix_with_delimeter: str = ':',
-                 redis_expire: int = 3600) -> None:
+                 redis_expire: int = 3600,
+                 serializer: Serializer | None = None,
+                 parent_attrs: tuple[str, ...] = (),
+                 expire_jitter: float = 0,
+                 soft_expire: int = 0,
+                 local_cache: LocalCache | None = None) -> None:
         self.redis = redis
+        self.serializer = PickleSerializer() if serializer is None else serializer
         self.redis_key_prefix = redis_key_prefix_with_delimeter
         self.redis_expire: int = redis_expire
+        self.redis_index_key = self._get_key(self.INDEX_KEY)
+        self.parent_attrs = parent_attrs
+        self.expire_jitter = expire_jitter
+        self.soft_expire = soft_expire
+        self.local_cache = local_cache
+
+    def _get_expire(self) -> int:
+        return self.redis_expire + random.randint(0, int(self.redis_expire * self.expire_jitter))
 
     def _get_key(self, key: Any) -> str:
         return f'{self.redis_key_prefix}{key}'
 
-    async def get_obj(self, key: Any) -> ModelType | None:
+    def _get_index_key(self, parent_id: tuple | None = None) -> str:
+        return (self.redis_index_key if parent_id is None else
+                ':'.join((self.redis_index_key, *map(str, parent_id))))
+
+    def _get_index_keys(self, obj: ModelType) -> list[str]:
+        parent_id = tuple(getattr(obj, attr, None) for attr in self.parent_attrs)
+        return ([self.redis_index_key] if not parent_id or None in parent_id else
+                [self.redis_index_key, self._get_index_key(parent_id)])
+
+    def _dumps(self, obj: ModelType) -> bytes:
+        soft_expiry = int(time()) + self.soft_expire if self.soft_expire else 0
+        return b'%d:%b' % (soft_expiry, self.serializer.dumps(obj))
+
+    def _loads(self, cache: bytes) -> tuple[Any, bool]:
+        soft_expiry, _, data = cache.partition(b':')
+        return self.serializer.loads(data), 0 < int(soft_expiry) <= time()
+
+    async def get_obj_stale(self, key: Any) -> tuple[ModelType | None, bool]:
+        """Returns the object and whether it is stale."""
         key = (key if (isinstance(key, str) and key.startswith(self.redis_key_prefix))  # type: ignore
                else self._get_key(key))
-        cache = await self.redis.get(key)
+        cache = (await self._mget([key]))[0]
         if cache:
-            result = serializer.loads(await self.redis.get(key))
+            result, stale = self._loads(cache)
             if result:
-                return result
-        return None
+                return result, stale
+        return None, False
+
+    async def get_obj(self, key: Any) -> ModelType | None:
+        return (await self.get_obj_stale(key))[0]
+
+    async def get_all(self, limit: int | None = None, after: int | None = None,
+                      parent_id: tuple | None = None) -> list[ModelType] | None:
+        return (await self.get_all_stale(limit, after, parent_id))[0]
+
+    async def get_all_stale(self, limit: int | None = None, after: int | None = None,
+                            parent_id: tuple | None = None) -> tuple[list[ModelType] | None, bool]:
+        """Returns the list (of the parent's children if `parent_id` is given) or its
+           keyset page: at most `limit` objects with id > `after`, taken by score,
+           and whether any of them is stale.
+           The index is trusted only if it has been marked complete by `set_all`,
+           otherwise objects cached one by one would pass for the whole list."""
+        ids = await self._get_ids(self._get_index_key(parent_id), limit, after)
+        if not ids:
+            return None, False
+        cache = await self._mget([self._get_key(id) for id in ids])
+        if None in cache:
+            return None, False
+        objs, stale = zip(*map(self._loads, cast(list[bytes], cache)))
+        return list(objs), any(stale)
+
+    async def _get_ids(self, index_key: str, limit: int | None, after: int | None) -> list[int] | None:
+        """The local cache keeps the whole index, the page is cut out of it locally."""
+        if self.local_cache is not None:
+            cache = self.local_cache.get(index_key)
+            if cache is None:
+                ids = await self._zrange(index_key, None, None)
+                if ids is None:
+                    return None
+                cache = b','.join(ids)
+                self.local_cache.set(index_key, cache)
+            index = [int(id) for id in cache.split(b',')] if cache else []
+            start = bisect_right(index, after or 0)
+            return index[start:None if limit is None else start + limit]
+        ids = await self._zrange(index_key, limit, after)
+        return None if ids is None else [int(id) for id in ids]
+
+    async def _zrange(self, index_key: str, limit: int | None, after: int | None) -> list[bytes] | None:
+        async with self.pipeline(transaction=False) as pipe:
+            pipe.zscore(index_key, self.INDEX_COMPLETE)
+            # ids are positive, so `(0` also skips the sentinel scored -inf
+            pipe.zrangebyscore(index_key, f'({after or 0}', '+inf',
+                               start=None if limit is None else 0, num=limit)
+            complete, ids = await pipe.execute()
+        REDIS_STATS['redis_misses' if complete is None else 'redis_hits'] += 1
+        return None if complete is None else ids
+
+    async def _mget(self, keys: list[str]) -> list[bytes | None]:
+        """Reads the keys missing in the local cache from Redis and caches them locally."""
+        values: list[bytes | None] = ([None] * len(keys) if self.local_cache is None else
+                                      [self.local_cache.get(key) for key in keys])
+        missing = [key for key, value in zip(keys, values) if value is None]
+        if missing:
+            fetched = dict(zip(missing, await self.redis.mget(missing)))
+            for key, value in fetched.items():
+                REDIS_STATS['redis_misses' if value is None else 'redis_hits'] += 1
+                if value is not None and self.local_cache is not None:
+                    self.local_cache.set(key, value)
+            values = [fetched[key] if value is None else value for key, value in zip(keys, values)]
+        return values
 
-    async def get_all(self) -> list[ModelType] | None:
-        result = [await self.get_obj(key.decode('utf-8')) for key in  # type: ignore
-                  await self.redis.keys(f'{self.redis_key_prefix}*')]
-        if result and None not in result:
-            return result  # type: ignore
-        return None
+    def _queue_invalidate(self, pipe: Pipeline, keys: list[str]) -> None:
+        if self.local_cache is not None:
+            self.local_cache.delete(keys)
+        # queued after the writes, so the other processes drop the keys once they are written
+        pipe.publish(INVALIDATE_CHANNEL, ' '.join(keys))
+
+    def pipeline(self, transaction: bool = True) -> Pipeline:
+        return self.redis.pipeline(transaction=transaction)
+
+    def _queue_set(self, pipe: Pipeline, obj: ModelType) -> None:
+        pipe.set(self._get_key(obj.id), self._dumps(obj), ex=self._get_expire())
+        for index_key in self._get_index_keys(obj):
+            pipe.zadd(index_key, {obj.id: obj.id})
+            pipe.expire(index_key, self._get_expire())
+
+    def _queue_delete(self, pipe: Pipeline, obj: ModelType) -> None:
+        pipe.delete(self._get_key(obj.id))
+        for index_key in self._get_index_keys(obj):
+            pipe.zrem(index_key, obj.id)
+
+    async def _batch(self, queue, objs: list[ModelType], pipe: Pipeline | None, transaction: bool) -> None:
+        """Queues commands into `pipe` if given (the caller executes it),
+           otherwise sends them in a pipeline of its own."""
+        if pipe is None:
+            async with self.pipeline(transaction) as pipe:
+                await self._batch(queue, objs, pipe, transaction)
+                await pipe.execute()
+            return
+        for obj in objs:
+            queue(pipe, obj)
+        self._queue_invalidate(pipe, list(dict.fromkeys(
+            key for obj in objs for key in (self._get_key(obj.id), *self._get_index_keys(obj)))))
+
+    async def set_many(self, objs: list[ModelType], pipe: Pipeline | None = None,
+                       transaction: bool = False) -> None:
+        if objs:
+            await self._batch(self._queue_set, objs, pipe, transaction)
+
+    async def delete_many(self, objs: list[ModelType], pipe: Pipeline | None = None,
+                          transaction: bool = False) -> None:
+        if objs:
+            await self._batch(self._queue_delete, objs, pipe, transaction)
 
     async def set_obj(self, obj: ModelType) -> None:
         if obj is not None:
-            await self.redis.set(self._get_key(obj.id),
-                                 serializer.dumps(obj),
-                                 ex=self.redis_expire)
+            await self.set_many([obj], transaction=True)
+
+    async def set_all(self, objs: list[ModelType], parent_id: tuple | None = None,
+                      pipe: Pipeline | None = None) -> None:
+        """`objs` must be the whole list (of the parent's children if `parent_id` is given).
+           Commands are queued into `pipe` if given (the caller executes it)."""
+        if objs is None:
+            return
+        if pipe is None:
+            async with self.pipeline() as pipe:
+                await self.set_all(objs, parent_id, pipe)
+                await pipe.execute()
+            return
+        index_key = self._get_index_key(parent_id)
+        pipe.delete(index_key)
+        await self.set_many(objs, pipe)
+        pipe.zadd(index_key, {self.INDEX_COMPLETE: float('-inf')})
+        pipe.expire(index_key, self._get_expire())
+        self._queue_invalidate(pipe, [index_key])
 
-    async def set_all(self, objs: list[ModelType]) -> None:
-        if objs is not None:
-            for obj in objs:
-                await self.set_obj(obj)  # type: ignore
+    async def set_all_with_parents(self, objs: list[ModelType], pipe: Pipeline) -> None:
+        """`objs` must be the whole list: the lists of their parents
+           (by `parent_attrs`) are marked complete too."""
+        parent_index_keys = {self._get_index_key(tuple(getattr(obj, attr) for attr in self.parent_attrs))
+                             for obj in objs} if self.parent_attrs else set()
+        for index_key in parent_index_keys:
+            pipe.delete(index_key)
+        # the objects are queued with the indexes of their parents too
+        await self.set_all(objs, pipe=pipe)
+        for index_key in parent_index_keys:
+            pipe.zadd(index_key, {self.INDEX_COMPLETE: float('-inf')})
+            pipe.expire(index_key, self._get_expire())
+        self._queue_invalidate(pipe, list(parent_index_keys))
 
     async def delete_obj(self, obj: ModelType) -> None:
         if obj is not None:
-            await self.redis.delete(self._get_key(obj.id))
+            await self.delete_many([obj], transaction=True)
+
+
+class RedisLock:
+    """Non-blocking lock on `SET NX EX`: `acquire` returns False at once if the lock
+       is held. The lock expires after `timeout` seconds should its owner die.
+       It is released under WATCH only by the owner's token (no Lua scripts)."""
+
+    def __init__(self, redis: Redis, key: str, timeout: int = 60) -> None:
+        self.redis = redis
+        self.key = key
+        self.timeout = timeout
+        self.token = uuid4().hex.encode()
+
+    async def acquire(self) -> bool:
+        return bool(await self.redis.set(self.key, self.token, nx=True, ex=self.timeout))
+
+    async def release(self) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self.key)
+                if await pipe.get(self.key) == self.token:
+                    pipe.multi()
+                    pipe.delete(self.key)
+                    await pipe.execute()
+            except WATCH_ERRORS:
+                # the lock expired and was taken by another owner meanwhile
+                pass
+
+
+class RedisResponseRepository:
+    """Stores ready response bodies under `response:<path>`. Every body is
+       prefixed with the generation it was built at, so bumping the generation
+       drops all of them at once."""
+    KEY_PREFIX = 'response:'
+    GENERATION_KEY = 'response:generation'
+
+    def __init__(self, redis: Redis, redis_expire: int = 3600) -> None:
+        self.redis = redis
+        self.redis_expire = redis_expire
+
+    def _get_key(self, path: str) -> str:
+        return f'{self.KEY_PREFIX}{path}'
+
+    async def get(self, path: str) -> tuple[bytes | None, int]:
+        """Returns the cached body (if still valid) and the current generation in one round-trip."""
+        generation, cache = await self.redis.mget(self.GENERATION_KEY, self._get_key(path))
+        generation = int(generation or 0)
+        if cache:
+            cache_generation, _, body = cache.partition(b':')
+            if int(cache_generation) == generation:
+                return body, generation
+        return None, generation
+
+    async def set(self, path: str, body: bytes, generation: int) -> None:
+        await self.redis.set(self._get_key(path), b'%d:%b' % (generation, body), ex=self.redis_expire)
+
+    def invalidate(self, pipe: Pipeline) -> None:
+        pipe.incr(self.GENERATION_KEY)
+
+
+class RedisVersionRepository:
+    """Version counters of the cached entities under `version:<entity>`,
+       bumped along with every write of the entity to the cache.
+       A missing counter starts from the current time, so the versions
+       given out before it was lost (eviction, flush) are not given out again."""
+    KEY_PREFIX = 'version:'
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+
+    def _get_key(self, entity: str) -> str:
+        return f'{self.KEY_PREFIX}{entity.rstrip(":")}'
+
+    async def get(self, entity: str) -> int:
+        key = self._get_key(entity)
+        version = await self.redis.get(key)
+        if version is None:
+            await self.redis.set(key, time_ns(), nx=True)
+            version = await self.redis.get(key)
+        return int(version)
+
+    def bump(self, pipe: Pipeline, *entities: str) -> None:
+        for key in {self._get_key(entity) for entity in entities}:
+            pipe.set(key, time_ns(), nx=True)
+            pipe.incr(key)
+
+
+class RedisCatalogueRepository:
+    """The version of the whole catalogue under `catalogue:version` and the log
+       of its changes: the `catalogue:changes` sorted set holds `<entity>:<id>`
+       of the changed and `deleted:<entity>:<id>` of the deleted objects scored
+       by the version of their last change. The log is complete since the version
+       under `catalogue:start`, at most `max_versions` back. A lost version
+       (eviction, flush) starts again from the current time in ms, so the versions
+       given out before are older than the log and the clients holding them reload.
+       Every new version is published to `CHANNEL` as the JSON of its changes."""
+    VERSION_KEY = 'catalogue:version'
+    START_KEY = 'catalogue:start'
+    CHANGES_KEY = 'catalogue:changes'
+    DELETED = 'deleted:'
+    CHANNEL = 'catalogue:events'
+
+    def __init__(self, redis: Redis, max_versions: int = 10000) -> None:
+        self.redis = redis
+        self.max_versions = max_versions
+
+    async def _get(self, redis: Pipeline) -> tuple[int, int]:
+        version, start = await redis.mget(self.VERSION_KEY, self.START_KEY)
+        if version is None:
+            version = start = int(time() * 1000)
+        return int(version), int(start or version)
+
+    async def _get_or_start(self) -> tuple[int, int]:
+        """Only the missing keys are set (NX), a version written meanwhile is kept."""
+        version, start = await self.redis.mget(self.VERSION_KEY, self.START_KEY)
+        if version is None or start is None:
+            now = int(time() * 1000)
+            async with self.redis.pipeline() as pipe:
+                pipe.set(self.VERSION_KEY, now, nx=True)
+                pipe.set(self.START_KEY, version or now, nx=True)
+                pipe.mget(self.VERSION_KEY, self.START_KEY)
+                *_, (version, start) = await pipe.execute()
+        return int(version), int(start)
+
+    async def get_version(self) -> int:
+        return (await self._get_or_start())[0]
+
+    async def get_changes(self, since: int) -> tuple[int, dict[str, list[str]] | None, dict[str, list[str]] | None]:
+        """Returns the version and the ids of the objects changed and deleted
+           after `since` by the entity, or Nones if the log does not reach `since`."""
+        version, start = await self._get_or_start()
+        if not start <= since <= version:
+            return version, None, None
+        changed: dict[str, list[str]] = {}
+        deleted: dict[str, list[str]] = {}
+        for member in await self.redis.zrangebyscore(self.CHANGES_KEY, f'({since}', '+inf'):
+            member = member.decode()
+            objs = deleted if member.startswith(self.DELETED) else changed
+            entity, _, id = member.removeprefix(self.DELETED).rpartition(':')
+            objs.setdefault(entity, []).append(id)
+        return version, changed, deleted
+
+    async def watch(self, pipe: Pipeline) -> tuple[int, int]:
+        """Watches the version for the transaction of `pipe`,
+           returns it with the version the log starts from."""
+        await pipe.watch(self.VERSION_KEY)
+        return await self._get(pipe)
+
+    def record(self, pipe: Pipeline, version: int, start: int, changed: dict[str, list], deleted: dict[str, list],
+               reset: bool = False) -> None:
+        """Queues the next version with the ids of the changed and deleted objects
+           by the prefix of their entity into the transaction of `pipe` started
+           after `watch`. `reset` starts the log anew: the objects are not known."""
+        version += 1
+        start = version if reset else max(start, version - self.max_versions)
+        pipe.mset({self.VERSION_KEY: version, self.START_KEY: start})
+        pipe.zremrangebyscore(self.CHANGES_KEY, '-inf', start)
+        for prefix, ids in changed.items():
+            if ids:
+                pipe.zrem(self.CHANGES_KEY, *(f'{self.DELETED}{prefix}{id}' for id in ids))
+                pipe.zadd(self.CHANGES_KEY, {f'{prefix}{id}': version for id in ids})
+        for prefix, ids in deleted.items():
+            if ids:
+                pipe.zrem(self.CHANGES_KEY, *(f'{prefix}{id}' for id in ids))
+                pipe.zadd(self.CHANGES_KEY, {f'{self.DELETED}{prefix}{id}': version for id in ids})
+        pipe.publish(self.CHANNEL, orjson.dumps({
+            'version': version, 'reload': reset,
+            'changed': {prefix.rstrip(':'): [str(id) for id in ids] for prefix, ids in changed.items() if ids},
+            'deleted': {prefix.rstrip(':'): [str(id) for id in ids] for prefix, ids in deleted.items() if ids}}))
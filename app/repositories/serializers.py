@@ -0,0 +1,40 @@
+import pickle
+from typing import Any, Protocol
+
+import orjson
+from pydantic import BaseModel
+
+
+class Serializer(Protocol):
+    def dumps(self, obj: Any) -> bytes:
+        ...
+
+    def loads(self, data: bytes) -> Any:
+        ...
+
+
+class PickleSerializer:
+    """Stores objects as they are, ORM instances included."""
+
+    def dumps(self, obj: Any) -> bytes:
+        return pickle.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+class SchemaSerializer:
+    """Stores the response shape of an object as orjson bytes.
+       Objects are validated by the schema once on write,
+       so on read they are rebuilt with `construct` without validation."""
+
+    def __init__(self, schema: type[BaseModel]) -> None:
+        self.schema = schema
+
+    def dumps(self, obj: Any) -> bytes:
+        if not isinstance(obj, self.schema):
+            obj = self.schema.from_orm(obj)
+        return orjson.dumps(obj.dict())
+
+    def loads(self, data: bytes) -> BaseModel:
+        return self.schema.construct(**orjson.loads(data))
@@ -1,2 +1,3 @@
 from .schemas import SubmenuOut  # noqa
+from .schemas import CatalogueChanges, CatalogueVersion  # noqa
 from .schemas import DishIn, DishOut, MenuIn, MenuOut, SubmenuIn  # noqa
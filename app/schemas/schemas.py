@@ -42,3 +42,13 @@ class MenuIn(TitleDescriptionMixin):
 class MenuOut(IdMixin, MenuIn):
     submenus_count: int
     dishes_count: int
+
+
+class CatalogueVersion(BaseModel):
+    version: int
+
+
+class CatalogueChanges(CatalogueVersion):
+    reload: bool = Field(description='The changes since the version are not known, the catalogue must be reloaded.')
+    changed: dict[str, list[str]] = Field(example={'menu': [ID], 'submenu': [], 'dish': []})
+    deleted: dict[str, list[str]] = Field(example={'menu': [], 'submenu': [], 'dish': [ID]})
@@ -1,8 +1,11 @@
 from typing import Annotated
 from fastapi import Depends
 from .base import BaseService
-from .services import MenuService, SubmenuService, DishService  # noqa
+from .services import ENTITIES, CatalogueService, MenuService, SubmenuService, DishService  # noqa
+from .response_cache import ResponseCache  # noqa
 
 menu_service = Annotated[MenuService, Depends()]
 submenu_service = Annotated[SubmenuService, Depends()]
 dish_service = Annotated[DishService, Depends()]
+catalogue_service = Annotated[CatalogueService, Depends()]
+response_cache = Annotated[ResponseCache, Depends()]
@@ -3,22 +3,40 @@ This is a base service class implementation.
 Please override set_cache_xxx methods with extra logic for Redis in the inherited class.
     * xxx - create/update/delete
 """
+import asyncio
 import typing
+from functools import partial
 
 import pydantic
 
 from fastapi import BackgroundTasks
-from app.repositories.base_db_repository import CRUDBaseRepository, ModelType
-from app.repositories.redis_repository import RedisBaseRepository
+from app.core import settings
+from app.repositories.base_db_repository import CRUDBaseRepository, LoaderOptions, ModelType
+from app.repositories.redis_repository import (
+    WATCH_ERRORS,
+    RedisBaseRepository,
+    RedisCatalogueRepository,
+    RedisLock,
+    RedisResponseRepository,
+    RedisVersionRepository,
+)
+from app.services.single_flight import single_flight
 
 
 class BaseService:
     """Base abstract service class."""
     MSG_NOT_IMPLEMENTED = "Method or function hasn't been implemented yet."
+    # Loader options the inherited services pick for their endpoints
+    read_options: LoaderOptions = ()
+    update_options: LoaderOptions = ()
+    delete_options: LoaderOptions = ()
 
     def __init__(self, db: CRUDBaseRepository, redis: RedisBaseRepository, bg_tasks: BackgroundTasks | None = None):
         self.db = db
         self.redis = redis
+        self.response_redis = RedisResponseRepository(redis.redis, redis.redis_expire)
+        self.versions = RedisVersionRepository(redis.redis)
+        self.catalogue = RedisCatalogueRepository(redis.redis, settings.catalogue_max_versions)
         self.bg_tasks = bg_tasks
 
     async def _add_bg_task(self, method, obj: ModelType | list[ModelType]) -> None:
@@ -29,15 +47,103 @@ class BaseService:
         if obj:
             await self.redis.set_all(obj) if isinstance(obj, list) else await self.redis.set_obj(obj)
 
-    async def __get(self, method_name: str | None = None, pk: int | None = None) -> ModelType | None:
-        obj = (await self.redis.get_all() if pk is None else
-               await self.redis.get_obj(pk))
+    async def _cache_batch(self,
+                           set: tuple[tuple[RedisBaseRepository, list], ...] = (),
+                           delete: tuple[tuple[RedisBaseRepository, list], ...] = (),
+                           changed: tuple[str, ...] = ()) -> None:
+        """Writes and deletes objects of several repositories, bumps the versions
+        of their entities (and of the `changed` ones) and drops the cached
+        responses in one transaction. The transaction bumps the catalogue version
+        and logs the objects as its changes, the `changed` entities (whose
+        objects are not known) start the log anew. It is retried if another
+        write has bumped the catalogue version meanwhile.
+        Repositories without objects are skipped, nothing is done without any."""
+        set = tuple((redis, objs) for redis, objs in set if objs)
+        delete = tuple((redis, objs) for redis, objs in delete if objs)
+        if not (set or delete or changed):
+            return
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    version, start = await self.catalogue.watch(pipe)
+                    pipe.multi()
+                    for redis, objs in delete:
+                        await redis.delete_many(objs, pipe)
+                    for redis, objs in set:
+                        await redis.set_many(objs, pipe)
+                    self.versions.bump(pipe, *changed, *(redis.redis_key_prefix for redis, _ in (*set, *delete)))
+                    self.catalogue.record(pipe, version, start,
+                                          {redis.redis_key_prefix: [obj.id for obj in objs] for redis, objs in set},
+                                          {redis.redis_key_prefix: [obj.id for obj in objs] for redis, objs in delete},
+                                          reset=bool(changed))
+                    self.response_redis.invalidate(pipe)
+                    await pipe.execute()
+                    return
+                except WATCH_ERRORS:
+                    continue
+
+    async def _load(self, key: str, load, cache, read_cache) -> typing.Any:
+        """Loads what is missing in the cache under `key` from the DB and caches it.
+        Concurrent misses of the same key in the process share one `load` (single flight).
+        With `settings.cache_lock` the processes take a Redis lock on the key as well:
+        the owner loads and caches at once, the others wait for the cache
+        and load by themselves only if it is not filled in time."""
+        return await single_flight.do(key, partial(self.__load, key, load, cache, read_cache))
+
+    async def __load(self, key: str, load, cache, read_cache) -> typing.Any:
+        if settings.cache_lock:
+            lock = RedisLock(self.redis.redis, f'lock:{key}', settings.cache_lock_timeout)
+            if await lock.acquire():
+                try:
+                    obj = await load()
+                    if obj:
+                        await cache(obj)
+                    return obj
+                finally:
+                    await lock.release()
+            for _ in range(settings.cache_lock_retries):
+                await asyncio.sleep(settings.cache_lock_wait)
+                obj = await read_cache()
+                if obj:
+                    return obj
+        obj = await load()
+        await self._add_bg_task(cache, obj)
+        return obj
+
+    async def _revalidate(self, key: str, load, cache) -> None:
+        """Refreshes the stale cache under `key` after the response is sent,
+        concurrent refreshes of the same key in the process are done once."""
+        async def refresh() -> None:
+            obj = await load()
+            if obj:
+                await cache(obj)
+
+        if self.bg_tasks is not None:
+            self.bg_tasks.add_task(single_flight.do, f'refresh:{key}', refresh)
+        else:
+            await single_flight.do(f'refresh:{key}', refresh)
+
+    async def __get(self, method_name: str = 'get', pk: int | None = None) -> ModelType | None:
+        obj: typing.Any
+        read_cache: typing.Callable[[], typing.Awaitable]
+        load: typing.Callable[[], typing.Awaitable]
+        refresh: typing.Callable[[], typing.Awaitable]
+        if pk is None:
+            obj, stale = await self.redis.get_all_stale()
+            key, read_cache = self.redis.redis_index_key, self.redis.get_all
+            load = refresh = partial(self.db.get_all, options=self.read_options)
+        else:
+            obj, stale = await self.redis.get_obj_stale(pk)
+            key = self.redis._get_key(pk)
+            read_cache = partial(self.redis.get_obj, pk)  # type: ignore [arg-type]
+            load = partial(getattr(self.db, method_name), pk, options=self.read_options)
+            # `get_or_404` of a deleted object would raise after the response is sent
+            refresh = partial(self.db.get, pk, options=self.read_options)
         if obj:
+            if stale:
+                await self._revalidate(key, refresh, self.set_cache)
             return obj
-        obj = (await self.db.get_all() if pk is None else
-               await self.db.__getattribute__(method_name)(pk))
-        await self._add_bg_task(self.set_cache, obj)
-        return obj
+        return await self._load(key, load, self.set_cache, read_cache)
 
     async def get(self, pk: int) -> ModelType | None:
         return await self.__get('get', pk)
@@ -48,6 +154,40 @@ class BaseService:
     async def get_all(self, exception: bool = False) -> list[ModelType] | None:
         return await self.__get()
 
+    async def _get_db_page(self, limit: int, after: int | None, parent_id: tuple | None
+                           ) -> list[ModelType] | None:
+        filters = {} if parent_id is None else dict(zip(self.redis.parent_attrs, parent_id))
+        return await self.db.get_all(options=self.read_options, limit=limit, after=after, **filters)
+
+    async def get_page(self, limit: int, after: int | None = None, parent_id: tuple | None = None
+                       ) -> tuple[list[ModelType], int | None]:
+        """Keyset page of the list (of the parent's children if `parent_id` is given):
+        at most `limit` objects with id > `after` and the cursor of the next page or None.
+        One extra object is read to learn whether the next page exists.
+        A first page that holds the whole list marks the cache index complete,
+        the objects of other pages are cached one by one."""
+        key = f'{self.redis._get_index_key(parent_id)}:{limit}:{after}'
+        load = partial(self._get_db_page, limit + 1, after, parent_id)
+        cache = partial(self._cache_page, limit, after, parent_id)
+        objs: list | None
+        objs, stale = await self.redis.get_all_stale(limit + 1, after, parent_id)
+        if objs and stale:
+            await self._revalidate(key, load, cache)
+        elif not objs:
+            objs = await self._load(key, load, cache, partial(self.redis.get_all, limit + 1, after, parent_id))
+        if not objs:
+            return [], None
+        if len(objs) > limit:
+            return objs[:limit], objs[limit - 1].id
+        return objs, None
+
+    async def _cache_page(self, limit: int, after: int | None, parent_id: tuple | None,
+                          objs: list[ModelType]) -> None:
+        if after is None and len(objs) <= limit:
+            await self.redis.set_all(objs, parent_id)
+        else:
+            await self.redis.set_many(objs)
+
     async def set_cache_create(self, obj) -> None:
         raise NotImplementedError(self.MSG_NOT_IMPLEMENTED)
 
@@ -70,12 +210,12 @@ class BaseService:
                      pk: int,
                      payload: pydantic.BaseModel) -> ModelType:
         """Base class provides database update method."""
-        obj = await self.db.update(pk, payload)
+        obj = await self.db.update(pk, payload, options=self.update_options)
         await self._add_bg_task(self.set_cache_update, obj)
         return obj
 
     async def delete(self, pk: int) -> ModelType:
         """Base class provides database delete method."""
-        obj = await self.db.delete(pk)
+        obj = await self.db.delete(pk, options=self.delete_options)
         await self._add_bg_task(self.set_cache_delete, obj)
         return obj
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+import orjson
+from aioredis import Redis
+from fastapi import HTTPException, status
+
+from app.repositories.local_cache import iter_messages
+from app.repositories.redis_repository import RedisCatalogueRepository
+
+logger = logging.getLogger(__name__)
+
+
+def reload_event(version: int) -> bytes:
+    return orjson.dumps({'version': version, 'reload': True, 'changed': {}, 'deleted': {}})
+
+
+class Subscriber:
+    """Bounded buffer of the events of one connection. A connection that falls
+       `buffer_size` events behind loses them for one `reload` event,
+       so a slow client holds neither the others nor unbounded memory."""
+
+    def __init__(self, buffer_size: int) -> None:
+        self.queue: asyncio.Queue[tuple[int, bytes]] = asyncio.Queue(buffer_size)
+        self.dropped = 0
+
+    def put(self, version: int, data: bytes) -> None:
+        try:
+            self.queue.put_nowait((version, data))
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait((version, reload_event(version)))
+
+
+class ChangeStream:
+    """Fans the catalogue changes published to `RedisCatalogueRepository.CHANNEL`
+       out to the subscribers of the process over one Redis subscription,
+       which is opened by the first subscriber and kept until `close`."""
+    SUBSCRIBE_TIMEOUT = 5
+    FULL = 'Too many subscribers.'
+
+    def __init__(self, buffer_size: int = 100, max_subscribers: int = 10000, ping_interval: float = 15) -> None:
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.ping_interval = ping_interval
+        self.subscribers: set[Subscriber] = set()
+        self.listener: asyncio.Task | None = None
+        self.subscribed = asyncio.Event()
+
+    def publish(self, data: bytes) -> None:
+        version = orjson.loads(data)['version']
+        for subscriber in self.subscribers:
+            subscriber.put(version, data)
+
+    async def listen(self, redis: Redis) -> None:
+        """Publishes the changes to the subscribers until cancelled.
+           They are sent a `reload` event on every resubscription, as changes may have been missed."""
+        catalogue = RedisCatalogueRepository(redis)
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(catalogue.CHANNEL)
+                    if self.subscribed.is_set():
+                        self.publish(reload_event(await catalogue.get_version()))
+                    self.subscribed.set()
+                    async for data in iter_messages(pubsub):
+                        self.publish(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Change stream listener failed, resubscribing')
+                await asyncio.sleep(1)
+
+    async def subscribe(self, redis: Redis) -> Subscriber:
+        if len(self.subscribers) >= self.max_subscribers:
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, self.FULL)
+        if self.listener is None:
+            self.listener = asyncio.create_task(self.listen(redis))
+        try:
+            await asyncio.wait_for(self.subscribed.wait(), self.SUBSCRIBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE)
+        subscriber = Subscriber(self.buffer_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    async def events(self, subscriber: Subscriber, first: bytes | None = None) -> AsyncIterator[bytes]:
+        """The events of `subscriber` (preceded by `first`) in the `text/event-stream` format,
+           a comment is sent after `ping_interval` seconds of silence to keep the connection.
+           The subscriber leaves when the client disconnects."""
+        try:
+            if first is not None:
+                yield b'id: %d\nevent: change\ndata: %b\n\n' % (orjson.loads(first)['version'], first)
+            while True:
+                try:
+                    version, data = await asyncio.wait_for(subscriber.queue.get(), self.ping_interval)
+                except asyncio.TimeoutError:
+                    yield b': ping\n\n'
+                    continue
+                yield b'id: %d\nevent: change\ndata: %b\n\n' % (version, data)
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def close(self) -> None:
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+        self.subscribed.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {'subscribers': len(self.subscribers),
+                'buffered': sum(subscriber.queue.qsize() for subscriber in self.subscribers)}
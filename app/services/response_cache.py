@@ -0,0 +1,68 @@
+from typing import Any
+
+import orjson
+from fastapi import Request, Response, status
+from pydantic import parse_obj_as
+from pydantic.json import pydantic_encoder
+
+from app.core import settings
+from app.repositories.redis_repository import RedisResponseRepository, RedisVersionRepository
+from app.services.services import redis
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether `If-None-Match` of the request holds `etag` (weak comparison, as for GET)."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is None:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+class ResponseCache:
+    """Opt-in (`settings.response_cache`) cache of GET response bodies keyed by the request path.
+    A hit is returned as is, skipping the response_model validation and encoding.
+    The response headers set by the endpoint are cached in front of the body.
+    Every response gets the ETag of the version of its entity and `settings.cache_control`,
+    a request that already holds the ETag is answered 304 before the cache or the DB is read."""
+    MEDIA_TYPE = 'application/json'
+
+    def __init__(self, request: Request, response: Response, redis: redis) -> None:
+        self.redis = RedisResponseRepository(redis, settings.redis_expire)
+        self.versions = RedisVersionRepository(redis)
+        self.request = request
+        self.response = response
+        self.headers: dict[str, str] = {}
+        self.path = request.url.path if not request.url.query else f'{request.url.path}?{request.url.query}'
+        self.generation = 0
+
+    def not_modified(self, etag: str) -> Response | None:
+        """Sets `etag` for the response, returns 304 if the request already holds it."""
+        self.headers = {'ETag': etag, 'Cache-Control': settings.cache_control}
+        if etag_matches(self.request, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=self.headers)
+        self.response.headers.update(self.headers)
+        return None
+
+    async def get(self, entity: str) -> Response | None:
+        """`entity` is the one the response is made of (e.g. `'menu'`)."""
+        if (response := self.not_modified(f'"{entity}-{await self.versions.get(entity)}"')) is not None:
+            return response
+        if not settings.response_cache:
+            return None
+        cache, self.generation = await self.redis.get(self.path)
+        if cache is None:
+            return None
+        headers, _, body = cache.partition(b'\n')
+        return Response(body, headers={**orjson.loads(headers), **self.headers}, media_type=self.MEDIA_TYPE)
+
+    async def set(self, content: Any, schema: Any, headers: dict[str, str] | None = None) -> Any:
+        """Caches `content` shaped by `schema` with the generation read in `get`,
+        so a body built before an invalidation is never taken for a fresh one."""
+        headers = {} if headers is None else headers
+        if not settings.response_cache:
+            self.response.headers.update(headers)
+            return content
+        body = orjson.dumps(parse_obj_as(schema, content), default=pydantic_encoder)
+        await self.redis.set(self.path, orjson.dumps(headers) + b'\n' + body, self.generation)
+        return Response(body, headers={**headers, **self.headers}, media_type=self.MEDIA_TYPE)
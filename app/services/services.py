@@ -1,87 +1,224 @@
-from typing import Annotated
+import hashlib
+from typing import Annotated, AsyncIterator, Iterable
 
+import orjson
 from aioredis import Redis
 from fastapi import Depends, BackgroundTasks
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app.core import get_aioredis, get_async_session
+from app.core import get_aioredis, get_async_session, settings
 from app.models import Dish, Menu, Submenu
 from app.repositories.db_repository import (
+    DISH_MENU_ID,
     DishRepository,
     MenuRepository,
     SubmenuRepository,
 )
-from app.repositories.redis_repository import RedisBaseRepository
+from app.repositories.local_cache import LocalCache
+from app.repositories.redis_repository import RedisBaseRepository, RedisCatalogueRepository
+from app.repositories.serializers import SchemaSerializer
+from app.schemas import DishOut, MenuOut, SubmenuOut
 from app.services.base import BaseService
+from app.services.change_stream import ChangeStream
 
 async_session = Annotated[AsyncSession, Depends(get_async_session)]
 redis = Annotated[Redis, Depends(get_aioredis)]
+# the entities are named by the prefixes of their keys in Redis
+ENTITIES = ('menu', 'submenu', 'dish')
+local_cache = LocalCache(settings.local_cache_max_entries, settings.local_cache_max_bytes, settings.local_cache_ttl)
+
+
+change_stream = ChangeStream(settings.stream_buffer_size, settings.stream_max_subscribers,
+                             settings.stream_ping_interval)
+
+
+def get_local_cache() -> LocalCache | None:
+    return local_cache if settings.local_cache else None
+
+
+def get_change_stream() -> ChangeStream:
+    return change_stream
+
+
+def get_menu_redis(redis: Redis) -> RedisBaseRepository:
+    return RedisBaseRepository(redis, 'menu:', settings.menu_hard_expire or settings.redis_expire,
+                               SchemaSerializer(MenuOut), expire_jitter=settings.redis_expire_jitter,
+                               soft_expire=settings.menu_soft_expire, local_cache=get_local_cache())
+
+
+def get_submenu_redis(redis: Redis) -> RedisBaseRepository:
+    return RedisBaseRepository(redis, 'submenu:', settings.submenu_hard_expire or settings.redis_expire,
+                               SchemaSerializer(SubmenuOut), parent_attrs=('menu_id',),
+                               expire_jitter=settings.redis_expire_jitter, soft_expire=settings.submenu_soft_expire,
+                               local_cache=get_local_cache())
+
+
+def get_dish_redis(redis: Redis) -> RedisBaseRepository:
+    return RedisBaseRepository(redis, 'dish:', settings.dish_hard_expire or settings.redis_expire,
+                               SchemaSerializer(DishOut), parent_attrs=('menu_id', 'submenu_id'),
+                               expire_jitter=settings.redis_expire_jitter, soft_expire=settings.dish_soft_expire,
+                               local_cache=get_local_cache())
+
+
+def build_tree(rows: Iterable[Row]) -> list[dict]:
+    """Assembles the rows of `MenuRepository.get_tree_rows` into menus
+    with their submenus and dishes in one pass."""
+    menus: list[dict] = []
+    menu = submenu = None
+    for row in rows:
+        if menu is None or menu['id'] != row.menu_id:
+            menu = {'id': row.menu_id, 'title': row.menu_title, 'description': row.menu_description, 'submenus': []}
+            menus.append(menu)
+            submenu = None
+        if row.submenu_id is None:
+            continue
+        if submenu is None or submenu['id'] != row.submenu_id:
+            submenu = {'id': row.submenu_id, 'menu_id': row.menu_id, 'title': row.submenu_title,
+                       'description': row.submenu_description, 'dishes': []}
+            menu['submenus'].append(submenu)
+        if row.dish_id is not None:
+            submenu['dishes'].append({'id': row.dish_id, 'submenu_id': row.submenu_id, 'title': row.dish_title,
+                                      'description': row.dish_description, 'price': row.dish_price})
+    return menus
 
 
 class MenuService(BaseService):
+    db: MenuRepository
+    # only the ids are needed to delete the tree from the DB and the cache
+    delete_options = (
+        load_only(Menu.id),
+        selectinload(Menu.submenus).load_only(Submenu.id, Submenu.menu_id)
+        .selectinload(Submenu.dishes).load_only(Dish.id, Dish.submenu_id)
+        .with_expression(Dish.menu_id, DISH_MENU_ID),
+    )
+
     def __init__(self, session: async_session, redis: redis, bg_tasks: BackgroundTasks):
-        super().__init__(MenuRepository(session), RedisBaseRepository(redis, 'menu:'), bg_tasks)
-        self.submenu_redis = RedisBaseRepository(redis, 'submenu:')
-        self.dish_redis = RedisBaseRepository(redis, 'dish:')
+        super().__init__(MenuRepository(session), get_menu_redis(redis), bg_tasks)
+        self.submenu_redis = get_submenu_redis(redis)
+        self.dish_redis = get_dish_redis(redis)
+
+    TREE_KEY = 'menus-tree'
+
+    async def get_tree(self) -> tuple[str, bytes]:
+        """The ETag and the JSON of the menus with their submenus and dishes.
+        The JSON is cached under the generation of the cached responses, so it is
+        built again only after a write or a synchronization has dropped them."""
+        cache, generation = await self.response_redis.get(self.TREE_KEY)
+        if cache is None:
+            body = orjson.dumps(build_tree(await self.db.get_tree_rows()))
+            cache = b'"%s"\n%b' % (hashlib.blake2b(body, digest_size=16).hexdigest().encode(), body)
+            await self.response_redis.set(self.TREE_KEY, cache, generation)
+        etag, _, body = cache.partition(b'\n')
+        return etag.decode(), body
 
     async def set_cache_create(self, menu: Menu) -> None:
-        await super().set_cache(menu)
+        await self._cache_batch(set=((self.redis, [menu]),))
 
     async def set_cache_update(self, menu: Menu) -> None:
-        await super().set_cache(menu)
+        await self._cache_batch(set=((self.redis, [menu]),))
 
     async def set_cache_delete(self, menu: Menu) -> None:
-        for submenu in menu.submenus:
-            for dish in submenu.dishes:
-                await self.dish_redis.delete_obj(dish)
-            await self.submenu_redis.delete_obj(submenu)
-        await self.redis.delete_obj(menu)
+        dishes = [dish for submenu in menu.submenus for dish in submenu.dishes]
+        await self._cache_batch(delete=((self.dish_redis, dishes),
+                                        (self.submenu_redis, menu.submenus),
+                                        (self.redis, [menu])))
 
 
 class SubmenuService(BaseService):
+    db: SubmenuRepository
+    delete_options = (
+        load_only(Submenu.id, Submenu.menu_id, Submenu.dishes_count),
+        selectinload(Submenu.dishes).load_only(Dish.id, Dish.submenu_id).with_expression(Dish.menu_id, DISH_MENU_ID),
+    )
+
     def __init__(self, session: async_session, redis: redis, bg_tasks: BackgroundTasks):
-        super().__init__(SubmenuRepository(session), RedisBaseRepository(redis, 'submenu:'), bg_tasks)
+        super().__init__(SubmenuRepository(session), get_submenu_redis(redis), bg_tasks)
         self.menu_db = MenuRepository(session)
-        self.menu_redis = RedisBaseRepository(redis, 'menu:')
-        self.dish_redis = RedisBaseRepository(redis, 'dish:')
+        self.menu_redis = get_menu_redis(redis)
+        self.dish_redis = get_dish_redis(redis)
 
     async def set_cache_create(self, submenu: Submenu) -> None:
-        menu: Menu = await self.menu_db.get_or_404(pk=submenu.menu_id)
-        for redis, item in ((self.menu_redis, menu), (self.redis, submenu)):
-            await redis.set_obj(item)  # type: ignore [type-var]
+        menu: Menu = await self.menu_db.get_or_404(submenu.menu_id, populate_existing=True)
+        await self._cache_batch(set=((self.menu_redis, [menu]), (self.redis, [submenu])))
 
     async def set_cache_update(self, submenu: Submenu) -> None:
-        await super().set_cache(submenu)
+        await self._cache_batch(set=((self.redis, [submenu]),))
 
     async def set_cache_delete(self, submenu: Submenu) -> None:
-        for dish in submenu.dishes:
-            await self.dish_redis.delete_obj(dish)
-        await self.redis.delete_obj(submenu)
         # refreshing related models
-        menu: Menu = await self.menu_db.get_or_404(pk=submenu.menu_id)
-        await self.menu_redis.set_obj(menu)
+        menu: Menu = await self.menu_db.get_or_404(submenu.menu_id, populate_existing=True)
+        await self._cache_batch(set=((self.menu_redis, [menu]),),
+                                delete=((self.dish_redis, submenu.dishes), (self.redis, [submenu])))
 
 
 class DishService(BaseService):
+    db: DishRepository
+    delete_options = (load_only(Dish.id, Dish.submenu_id),)
+
     def __init__(self, session: async_session, redis: redis, bg_tasks: BackgroundTasks):
-        super().__init__(DishRepository(session), RedisBaseRepository(redis, 'dish:'), bg_tasks)
+        super().__init__(DishRepository(session), get_dish_redis(redis), bg_tasks)
         self.submenu_db = SubmenuRepository(session)
-        self.submenu_redis = RedisBaseRepository(redis, 'submenu:')
+        self.submenu_redis = get_submenu_redis(redis)
         self.menu_db = MenuRepository(session)
-        self.menu_redis = RedisBaseRepository(redis, 'menu:')
+        self.menu_redis = get_menu_redis(redis)
+
+    async def _get_db_page(self, limit: int, after: int | None, parent_id: tuple | None) -> list[Dish] | None:
+        if parent_id is None:
+            return await super()._get_db_page(limit, after, parent_id)
+        menu_id, submenu_id = parent_id
+        return await self.db.list_by_submenu(submenu_id, menu_id, limit, after, options=self.read_options)
 
     async def set_cache_create(self, dish: Dish) -> None:
-        submenu: Submenu = await self.submenu_db.get_or_404(pk=dish.submenu_id)
-        menu: Menu = await self.menu_db.get_or_404(pk=submenu.menu_id)
-        for redis, item in ((self.menu_redis, menu), (self.submenu_redis, submenu), (self.redis, dish)):
-            await redis.set_obj(item)  # type: ignore [type-var]
+        submenu: Submenu = await self.submenu_db.get_or_404(dish.submenu_id, populate_existing=True)
+        set_committed_value(dish, 'menu_id', submenu.menu_id)
+        menu: Menu = await self.menu_db.get_or_404(submenu.menu_id, populate_existing=True)
+        await self._cache_batch(set=((self.menu_redis, [menu]), (self.submenu_redis, [submenu]), (self.redis, [dish])))
 
     async def set_cache_update(self, dish: Dish) -> None:
-        await super().set_cache(dish)
+        await self._cache_batch(set=((self.redis, [dish]),))
 
     async def set_cache_delete(self, dish: Dish) -> None:
-        await self.redis.delete_obj(dish)
-        submenu: Submenu = await self.submenu_db.get_or_404(pk=dish.submenu_id)
-        menu: Menu = await self.menu_db.get_or_404(pk=submenu.menu_id)
-        for redis, item in ((self.menu_redis, menu), (self.submenu_redis, submenu)):
-            await redis.set_obj(item)  # type: ignore [type-var]
+        submenu: Submenu = await self.submenu_db.get_or_404(dish.submenu_id, populate_existing=True)
+        menu: Menu = await self.menu_db.get_or_404(submenu.menu_id, populate_existing=True)
+        await self._cache_batch(set=((self.menu_redis, [menu]), (self.submenu_redis, [submenu])),
+                                delete=((self.redis, [dish]),))
+
+
+class CatalogueService:
+    """The catalogue version and its changes for the incremental refreshes of the clients."""
+
+    def __init__(self, redis: redis, change_stream: Annotated[ChangeStream, Depends(get_change_stream)]):
+        self.redis = RedisCatalogueRepository(redis, settings.catalogue_max_versions)
+        self.change_stream = change_stream
+
+    async def get_version(self) -> dict:
+        return {'version': await self.redis.get_version()}
+
+    async def get_changes(self, since: int) -> dict:
+        """The ids of the objects changed and deleted after the `since` version
+        by the entity, or `reload` if the log of the changes does not reach it."""
+        version, changed, deleted = await self.redis.get_changes(since)
+        reload = changed is None
+
+        def by_entity(objs: dict[str, list[str]] | None) -> dict[str, list[str]]:
+            return {entity: (objs or {}).get(entity, []) for entity in ENTITIES}
+
+        return {'version': version, 'reload': reload, 'changed': by_entity(changed), 'deleted': by_entity(deleted)}
+
+    async def stream(self, last_event_id: int | None = None) -> AsyncIterator[bytes]:
+        """The server-sent events of the catalogue changes. A client reconnecting
+        with the `last_event_id` version first gets the changes it has missed."""
+        subscriber = await self.change_stream.subscribe(self.redis.redis)
+        try:
+            first = None
+            if last_event_id is not None:
+                changes = await self.get_changes(last_event_id)
+                if changes['version'] != last_event_id:
+                    first = orjson.dumps(changes)
+        except BaseException:
+            self.change_stream.unsubscribe(subscriber)
+            raise
+        return self.change_stream.events(subscriber, first)
@@ -0,0 +1,22 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one call: the first caller starts it,
+       the others await its result (or its exception). The key is forgotten as soon
+       as the call is done, so nothing is cached here."""
+
+    def __init__(self) -> None:
+        self.calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        call = self.calls.get(key)
+        if call is None:
+            call = self.calls[key] = asyncio.ensure_future(func())
+            call.add_done_callback(lambda _: self.calls.pop(key, None))
+        # a cancelled caller does not cancel the call the others are waiting for
+        return await asyncio.shield(call)
+
+
+single_flight = SingleFlight()
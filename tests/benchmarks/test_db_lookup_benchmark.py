@@ -0,0 +1,51 @@
+"""
+Время поиска объекта по первичному ключу и по атрибутам.
+Для вывода результатов запускать с ключом -s:
+    pytest tests/benchmarks/test_db_lookup_benchmark.py -s
+"""
+from time import perf_counter
+
+from sqlalchemy import select
+
+from tests import conftest as c
+from tests.fixtures import data as d
+
+NUMBER = 200
+
+pytestmark = c.pytest_mark_anyio
+
+
+async def benchmark(lookup) -> float:
+    await lookup()
+    start = perf_counter()
+    for _ in range(NUMBER):
+        await lookup()
+    return (perf_counter() - start) / NUMBER
+
+
+async def test_get_by_pk_benchmark(menu: c.Response, get_menu_repo: c.MenuRepository) -> None:
+    session = get_menu_repo.session
+
+    async def select_first() -> c.Menu:
+        # the way `get` used to read by primary key
+        return (await session.scalars(select(c.Menu).filter_by(id=d.ID).order_by(c.Menu.id))).first()
+
+    select_time = await benchmark(select_first)
+    # the identity map holds weak references, so the object is kept alive as the services do
+    menu_obj = await get_menu_repo.get(d.ID)
+    get_time = await benchmark(lambda: get_menu_repo.get(d.ID))
+    assert await get_menu_repo.get(d.ID) is menu_obj
+    print(f'\nselect().first(): {select_time * 1e6:.1f} us, session.get(): {get_time * 1e6:.1f} us')
+    assert get_time < select_time
+
+
+async def test_get_by_attrs_benchmark(menu: c.Response, get_menu_repo: c.MenuRepository) -> None:
+    session = get_menu_repo.session
+    title = d.MENU_POST_PAYLOAD['title']
+
+    async def build_select() -> c.Menu:
+        return (await session.scalars(select(c.Menu).filter_by(title=title).order_by(c.Menu.id))).first()
+
+    build_time = await benchmark(build_select)
+    cached_time = await benchmark(lambda: get_menu_repo._get_by_attrs(title=title))
+    print(f'\nbuilt per call: {build_time * 1e6:.1f} us, built once: {cached_time * 1e6:.1f} us')
@@ -0,0 +1,59 @@
+"""
+Чтение большого файла меню: полная загрузка книги и потоковое чтение.
+Для вывода результатов запускать с ключом -s:
+    pytest tests/benchmarks/test_read_file_benchmark.py -s
+"""
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from app.celery_tasks.utils import iter_records
+
+MENUS = 10
+SUBMENUS = 10
+DISHES = 50
+
+
+@pytest.fixture(scope='module')
+def large_file(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    fname = tmp_path_factory.mktemp('benchmark') / 'Menu.xlsx'
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Лист1')
+    for i in range(MENUS):
+        ws.append((i, f'menu {i}', 'menu description'))
+        for j in range(SUBMENUS):
+            ws.append((None, j, f'submenu {i}.{j}', 'submenu description'))
+            for k in range(DISHES):
+                ws.append((None, None, k, f'dish {i}.{j}.{k}', 'dish description', 12.5))
+    wb.save(fname)
+    return fname
+
+
+def read_full(fname: Path) -> int:
+    """The way the file used to be read."""
+    return sum(1 for _ in load_workbook(filename=fname)['Лист1'].values)
+
+
+def read_streaming(fname: Path) -> int:
+    return sum(1 for _ in iter_records(fname))
+
+
+def benchmark(read, fname: Path) -> tuple[int, float, int]:
+    tracemalloc.start()
+    start = perf_counter()
+    rows = read(fname)
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, seconds, peak
+
+
+def test_read_file_benchmark(large_file: Path) -> None:
+    results = {read.__name__: benchmark(read, large_file) for read in (read_full, read_streaming)}
+    for name, (rows, seconds, peak) in results.items():
+        print(f'\n{name}: {rows} rows, {rows / seconds:.0f} rows/sec, peak {peak / 2 ** 20:.1f} MiB')
+    assert results['read_full'][0] == results['read_streaming'][0] == MENUS * SUBMENUS * (DISHES + 1) + MENUS
+    assert results['read_streaming'][2] < results['read_full'][2] / 3
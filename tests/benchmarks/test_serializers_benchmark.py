@@ -0,0 +1,47 @@
+"""
+Сравнение сериализаторов кэша: время dumps/loads и размер данных.
+Для вывода результатов запускать с ключом -s:
+    pytest tests/benchmarks/test_serializers_benchmark.py -s
+"""
+from timeit import timeit
+
+import pytest
+
+from app.repositories.serializers import PickleSerializer, SchemaSerializer
+from tests import conftest as c
+
+NUMBER = 200
+SUBMENUS = 5
+DISHES = 20
+
+
+def get_menu() -> c.Menu:
+    """Menu with the whole tree loaded, as it used to be pickled."""
+    return c.Menu(
+        id=1, title='menu', description='menu description',
+        submenus_count=SUBMENUS, dishes_count=SUBMENUS * DISHES,
+        submenus=[c.Submenu(
+            id=i, menu_id=1, title=f'submenu {i}', description='submenu description', dishes_count=DISHES,
+            dishes=[c.Dish(id=i * DISHES + j, submenu_id=i, title=f'dish {i}.{j}',
+                           description='dish description', price=12.5)
+                    for j in range(DISHES)])
+            for i in range(SUBMENUS)])
+
+
+def benchmark(serializer, obj) -> tuple[float, float, int]:
+    data = serializer.dumps(obj)
+    dumps_time = timeit(lambda: serializer.dumps(obj), number=NUMBER) / NUMBER
+    loads_time = timeit(lambda: serializer.loads(data), number=NUMBER) / NUMBER
+    return dumps_time, loads_time, len(data)
+
+
+@pytest.mark.parametrize('serializer', (PickleSerializer(), SchemaSerializer(c.MenuOut)))
+def test_serializer_benchmark(serializer) -> None:
+    dumps_time, loads_time, size = benchmark(serializer, get_menu())
+    print(f'\n{type(serializer).__name__}: dumps {dumps_time * 1e6:.1f} us, '
+          f'loads {loads_time * 1e6:.1f} us, size {size} bytes')
+
+
+def test_schema_serializer_payload_is_smaller() -> None:
+    menu = get_menu()
+    assert len(SchemaSerializer(c.MenuOut).dumps(menu)) < len(PickleSerializer().dumps(menu)) / 10
@@ -0,0 +1,61 @@
+"""
+Сколько простаивающих подписчиков потока изменений держит один процесс:
+память на подписчика и время доставки одного изменения всем.
+Для вывода результатов запускать с ключом -s:
+    pytest tests/benchmarks/test_stream_benchmark.py -s
+"""
+import asyncio
+import tracemalloc
+from time import perf_counter
+
+import pytest
+
+from app.repositories.redis_repository import RedisCatalogueRepository
+from app.services.change_stream import ChangeStream
+from tests import conftest as c
+
+SUBSCRIBERS = (1000, 10000)
+
+pytestmark = c.pytest_mark_anyio
+
+
+async def receive_one(stream: ChangeStream, subscriber) -> bytes:
+    """An idle connection: waits for the first change, skipping the pings."""
+    events = stream.events(subscriber)
+    try:
+        async for event in events:
+            if event.startswith(b'id:'):
+                return event
+    finally:
+        await events.aclose()
+
+
+@pytest.mark.parametrize('number', SUBSCRIBERS)
+async def test_idle_subscribers_benchmark(get_test_redis: c.FakeRedis, number: int) -> None:
+    stream = ChangeStream(max_subscribers=number)
+    catalogue = RedisCatalogueRepository(get_test_redis)
+    try:
+        # the Redis subscription is opened before measuring
+        stream.unsubscribe(await stream.subscribe(get_test_redis))
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tasks = [asyncio.create_task(receive_one(stream, await stream.subscribe(get_test_redis)))
+                 for _ in range(number)]
+        await asyncio.sleep(0)
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        start = perf_counter()
+        async with get_test_redis.pipeline() as pipe:
+            version, log_start = await catalogue.watch(pipe)
+            pipe.multi()
+            catalogue.record(pipe, version, log_start, {'menu:': [1]}, {})
+            await pipe.execute()
+        events = await asyncio.wait_for(asyncio.gather(*tasks), 60)
+        seconds = perf_counter() - start
+    finally:
+        await stream.close()
+    print(f'\n{number} idle subscribers: {memory / number / 1024:.1f} KiB each, '
+          f'one change delivered to all in {seconds * 1000:.0f} ms')
+    assert len(set(events)) == 1
+    assert not stream.subscribers
+    assert memory / number < 16 * 1024
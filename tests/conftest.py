@@ -5,6 +5,7 @@ import pytest_asyncio
 from fakeredis.aioredis import FakeRedis
 from fastapi import Request, Response  # noqa
 from httpx import AsyncClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.core import Base, get_aioredis, get_async_session, settings
@@ -12,7 +13,7 @@ from app.main import app
 from app.models import Dish, Menu, Submenu  # noqa
 from app.repositories import DishRepository, MenuRepository, SubmenuRepository  # noqa
 from app.repositories.base_db_repository import CRUDBaseRepository  # noqa
-from app.schemas import MenuIn, MenuOut  # noqa
+from app.schemas import DishIn, MenuIn, MenuOut, SubmenuIn  # noqa
 from app.services import BaseService, DishService, MenuService, SubmenuService  # noqa
 from app.celery_tasks.utils import FILE_PATH  # noqa
 
@@ -87,6 +88,20 @@ async def dish(async_client: AsyncClient, submenu: Response) -> Response:
 
 
 # --- Fixtures for repository testing -----------------------------------------------
+@pytest.fixture
+def sql_statements() -> Generator[list[str], Any, None]:
+    """Collects the SQL statements sent to the test DB."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+
+
+
 @pytest_asyncio.fixture
 async def get_test_session() -> Generator[Any, Any, None]:
     async with TestingSessionLocal() as session:
@@ -0,0 +1,81 @@
+import pytest
+from fastapi import status
+
+from app.services.change_stream import ChangeStream
+from app.services.services import get_change_stream
+from tests import conftest as c
+from tests.fixtures import data as d
+
+pytestmark = c.pytest_mark_anyio
+
+ENDPOINT_VERSION = f'{d.PREFIX}version'
+ENDPOINT_CHANGES = f'{d.PREFIX}changes'
+
+
+@pytest.fixture
+def shared_redis(monkeypatch: pytest.MonkeyPatch, get_test_redis: c.FakeRedis) -> c.FakeRedis:
+    """The default redis override flushes the cache after every request."""
+    monkeypatch.setitem(c.app.dependency_overrides, c.get_aioredis, lambda: get_test_redis)
+    return get_test_redis
+
+
+async def _get_version(async_client: c.AsyncClient) -> int:
+    response = await async_client.get(ENDPOINT_VERSION)
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    return response.json()['version']
+
+
+async def _get_changes(async_client: c.AsyncClient, since: int) -> dict:
+    response = await async_client.get(ENDPOINT_CHANGES, params={'since': since})
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    return response.json()
+
+
+async def test_writes_bump_version(shared_redis: c.FakeRedis, async_client: c.AsyncClient) -> None:
+    version = await _get_version(async_client)
+    assert await _get_version(async_client) == version
+    await async_client.post(d.ENDPOINT_MENU, json=d.MENU_POST_PAYLOAD)
+    assert await _get_version(async_client) == version + 1
+    await async_client.patch(f'{d.ENDPOINT_MENU}/{d.ID}', json=d.MENU_PATCH_PAYLOAD)
+    assert await _get_version(async_client) == version + 2
+
+
+async def test_changes(shared_redis: c.FakeRedis, async_client: c.AsyncClient) -> None:
+    version = await _get_version(async_client)
+    assert await _get_changes(async_client, version) == {
+        'version': version, 'reload': False,
+        'changed': {'menu': [], 'submenu': [], 'dish': []},
+        'deleted': {'menu': [], 'submenu': [], 'dish': []}}
+    await async_client.post(d.ENDPOINT_MENU, json=d.MENU_POST_PAYLOAD)
+    await async_client.post(d.ENDPOINT_SUBMENU, json=d.SUBMENU_POST_PAYLOAD)
+    await async_client.post(d.ENDPOINT_DISH, json=d.DISH_POST_PAYLOAD)
+    changes = await _get_changes(async_client, version)
+    assert changes['version'] == version + 3
+    assert changes['changed'] == {'menu': ['1'], 'submenu': ['1'], 'dish': ['1']}
+    await async_client.delete(f'{d.ENDPOINT_SUBMENU}/{d.ID}')
+    changes = await _get_changes(async_client, version + 3)
+    assert changes['changed'] == {'menu': ['1'], 'submenu': [], 'dish': []}
+    assert changes['deleted'] == {'menu': [], 'submenu': ['1'], 'dish': ['1']}
+
+
+async def test_changes_since_unknown_version(shared_redis: c.FakeRedis, async_client: c.AsyncClient) -> None:
+    version = await _get_version(async_client)
+    changes = await _get_changes(async_client, version + 1)
+    assert changes['reload'] is True
+    assert changes['version'] == version
+
+
+async def test_changes_needs_since(async_client: c.AsyncClient) -> None:
+    for params in ({}, {'since': -1}, {'since': 'a'}):
+        response = await async_client.get(ENDPOINT_CHANGES, params=params)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_stream_over_max_subscribers(monkeypatch: pytest.MonkeyPatch, async_client: c.AsyncClient) -> None:
+    monkeypatch.setitem(c.app.dependency_overrides, get_change_stream, lambda: ChangeStream(max_subscribers=0))
+    response = await async_client.get(f'{d.ENDPOINT_MENU}/stream')
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()['detail'] == ChangeStream.FULL
+    response = await async_client.get(f'{d.ENDPOINT_MENU}/stream', headers={'Last-Event-ID': 'a'})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
@@ -95,3 +95,61 @@ async def test_dish_post(submenu: c.Response, async_client: c.AsyncSession, get_
                          msg_not_found=d.DISH_NOT_FOUND_MSG,
                          func_check_valid_response=u.check_dish)
     assert await get_dish_repo.get_all() is not None
+
+
+async def test_redis_pool_metrics(async_client: c.AsyncClient) -> None:
+    response = await async_client.get(f'{d.PREFIX}metrics/redis-pool')
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    assert response.json()['max_connections'] == c.settings.redis_max_connections
+
+
+async def test_full_list_etag(dish: c.Response, async_client: c.AsyncClient) -> None:
+    response = await async_client.get(d.ENDPOINT_FULL_LIST)
+    etag = response.headers['etag']
+    assert response.json() == d.EXPECTED_FULL_LIST
+    for if_none_match in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+        response = await async_client.get(d.ENDPOINT_FULL_LIST, headers={'If-None-Match': if_none_match})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.headers['etag'] == etag
+        assert response.headers['cache-control'] == c.settings.cache_control
+        assert response.content == b''
+    response = await async_client.get(d.ENDPOINT_FULL_LIST, headers={'If-None-Match': '"other"'})
+    assert response.status_code == status.HTTP_200_OK
+
+
+async def test_cache_metrics(async_client: c.AsyncClient) -> None:
+    response = await async_client.get(f'{d.PREFIX}metrics/cache')
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    assert set(response.json()) == {'l1_entries', 'l1_bytes', 'l1_hits', 'l1_misses', 'redis_hits', 'redis_misses'}
+
+
+async def test_stream_metrics(async_client: c.AsyncClient) -> None:
+    response = await async_client.get(f'{d.PREFIX}metrics/stream')
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    assert response.json() == {'subscribers': 0, 'buffered': 0}
+
+
+@pytest.mark.parametrize('endpoint', (d.ENDPOINT_MENU, d.ENDPOINT_SUBMENU, d.ENDPOINT_DISH))
+async def test_get_all_pagination(dish: c.Response, async_client: c.AsyncClient, endpoint: str) -> None:
+    response = await async_client.post(endpoint, json={'title': 'Second', 'description': 'Second', 'price': '1'})
+    assert response.status_code == status.HTTP_201_CREATED, response.json()
+    second_id = response.json()['id']
+    response = await async_client.get(endpoint, params={'limit': 1})
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    assert [item['id'] for item in response.json()] == [str(d.ID)]
+    assert response.headers['X-Next-Cursor'] == str(d.ID)
+    response = await async_client.get(endpoint, params={'limit': 1, 'after': d.ID})
+    assert [item['id'] for item in response.json()] == [second_id]
+    assert 'X-Next-Cursor' not in response.headers
+
+
+@pytest.mark.parametrize('params', ({'limit': 0}, {'limit': c.settings.page_size_max + 1}, {'after': -1}))
+async def test_get_all_pagination_invalid_params(async_client: c.AsyncClient, params: dict) -> None:
+    response = await async_client.get(d.ENDPOINT_MENU, params=params)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, response.json()
+
+
+async def test_get_dishes_of_submenu_of_other_menu(dish: c.Response, async_client: c.AsyncClient) -> None:
+    response = await async_client.get(f'{d.PREFIX}menus/{d.ID + 1}/submenus/{d.ID}/dishes')
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    assert response.json() == []
@@ -0,0 +1,139 @@
+import pytest
+from fastapi import status
+
+from tests import conftest as c
+from tests.fixtures import data as d
+
+pytestmark = c.pytest_mark_anyio
+
+
+@pytest.fixture
+def response_cache_on(monkeypatch: pytest.MonkeyPatch, get_test_redis: c.FakeRedis) -> c.FakeRedis:
+    """The default redis override flushes the cache after every request."""
+    monkeypatch.setattr(c.settings, 'response_cache', True)
+    monkeypatch.setitem(c.app.dependency_overrides, c.get_aioredis, lambda: get_test_redis)
+    return get_test_redis
+
+
+async def _rename_menu_in_db(get_menu_repo: c.MenuRepository, title: str) -> None:
+    menu = await get_menu_repo.get(d.ID)
+    menu.title = title
+    await get_menu_repo._save(menu)
+
+
+@pytest.mark.parametrize('endpoint', (d.ENDPOINT_MENU, f'{d.ENDPOINT_MENU}/{d.ID}', d.ENDPOINT_FULL_LIST))
+async def test_get_returns_cached_body(response_cache_on: c.FakeRedis,
+                                       dish: c.Response,
+                                       async_client: c.AsyncClient,
+                                       get_menu_repo: c.MenuRepository,
+                                       endpoint: str) -> None:
+    response = await async_client.get(endpoint)
+    assert response.status_code == status.HTTP_200_OK
+    await _rename_menu_in_db(get_menu_repo, 'Changed behind the cache')
+    cached = await async_client.get(endpoint)
+    assert cached.status_code == status.HTTP_200_OK
+    assert cached.content == response.content
+
+
+@pytest.mark.parametrize('endpoint, expected', (
+    (d.ENDPOINT_MENU, [d.EXPECTED_MENU]),
+    (f'{d.ENDPOINT_MENU}/{d.ID}', d.EXPECTED_MENU),
+    (d.ENDPOINT_SUBMENU, [d.EXPECTED_SUBMENU]),
+    (f'{d.ENDPOINT_SUBMENU}/{d.ID}', d.EXPECTED_SUBMENU),
+    (d.ENDPOINT_DISH, [d.CREATED_DISH]),
+    (f'{d.ENDPOINT_DISH}/{d.ID}', d.CREATED_DISH),
+    (d.ENDPOINT_FULL_LIST, d.EXPECTED_FULL_LIST),
+))
+async def test_cached_body_equals_response(response_cache_on: c.FakeRedis,
+                                           dish: c.Response,
+                                           async_client: c.AsyncClient,
+                                           endpoint: str,
+                                           expected: dict | list) -> None:
+    for _ in range(2):
+        response = await async_client.get(endpoint)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['content-type'] == 'application/json'
+        assert response.json() == expected
+
+
+async def test_cached_response_keeps_next_cursor(response_cache_on: c.FakeRedis,
+                                                 dish: c.Response,
+                                                 async_client: c.AsyncClient) -> None:
+    await async_client.post(d.ENDPOINT_MENU, json={'title': 'Second', 'description': 'Second'})
+    for _ in range(2):
+        response = await async_client.get(d.ENDPOINT_MENU, params={'limit': 1})
+        assert response.json() == [d.EXPECTED_MENU]
+        assert response.headers['X-Next-Cursor'] == str(d.ID)
+
+
+async def test_write_invalidates_cached_body(response_cache_on: c.FakeRedis,
+                                             dish: c.Response,
+                                             async_client: c.AsyncClient) -> None:
+    endpoint = f'{d.ENDPOINT_MENU}/{d.ID}'
+    assert (await async_client.get(endpoint)).json() == d.EXPECTED_MENU
+    response = await async_client.patch(endpoint, json=d.MENU_PATCH_PAYLOAD)
+    assert response.status_code == status.HTTP_200_OK
+    assert (await async_client.get(endpoint)).json() == d.UPDATED_MENU
+    response = await async_client.delete(f'{d.ENDPOINT_DISH}/{d.ID}')
+    assert response.status_code == status.HTTP_200_OK
+    assert (await async_client.get(endpoint)).json()['dishes_count'] == 0
+
+
+@pytest.mark.parametrize('cache_body', (True, False))
+@pytest.mark.parametrize('endpoint, entity, payload', (
+    (d.ENDPOINT_MENU, 'menu', d.MENU_PATCH_PAYLOAD),
+    (f'{d.ENDPOINT_MENU}/{d.ID}', 'menu', d.MENU_PATCH_PAYLOAD),
+    (d.ENDPOINT_SUBMENU, 'submenu', d.SUBMENU_PATCH_PAYLOAD),
+    (f'{d.ENDPOINT_SUBMENU}/{d.ID}', 'submenu', d.SUBMENU_PATCH_PAYLOAD),
+    (d.ENDPOINT_DISH, 'dish', d.DISH_PATCH_PAYLOAD),
+    (f'{d.ENDPOINT_DISH}/{d.ID}', 'dish', d.DISH_PATCH_PAYLOAD),
+))
+async def test_conditional_get(response_cache_on: c.FakeRedis,
+                               monkeypatch: pytest.MonkeyPatch,
+                               dish: c.Response,
+                               async_client: c.AsyncClient,
+                               sql_statements: list[str],
+                               endpoint: str,
+                               entity: str,
+                               payload: dict,
+                               cache_body: bool) -> None:
+    monkeypatch.setattr(c.settings, 'response_cache', cache_body)
+    response = await async_client.get(endpoint)
+    etag = response.headers['etag']
+    assert etag.startswith(f'"{entity}-')
+    assert response.headers['cache-control'] == c.settings.cache_control
+    sql_statements.clear()
+    response = await async_client.get(endpoint, headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers['etag'] == etag
+    assert response.content == b''
+    assert not sql_statements
+    item = endpoint if endpoint.endswith(f'/{d.ID}') else f'{endpoint}/{d.ID}'
+    assert (await async_client.patch(item, json=payload)).status_code == status.HTTP_200_OK
+    response = await async_client.get(endpoint, headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['etag'] != etag
+    assert response.json()
+
+
+async def test_write_of_dish_changes_etag_of_menu(response_cache_on: c.FakeRedis,
+                                                  dish: c.Response,
+                                                  async_client: c.AsyncClient) -> None:
+    etag = (await async_client.get(d.ENDPOINT_MENU)).headers['etag']
+    await async_client.delete(f'{d.ENDPOINT_DISH}/{d.ID}')
+    response = await async_client.get(d.ENDPOINT_MENU, headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0]['dishes_count'] == 0
+
+
+async def test_response_cache_off(get_test_redis: c.FakeRedis,
+                                  monkeypatch: pytest.MonkeyPatch,
+                                  menu: c.Response,
+                                  async_client: c.AsyncClient,
+                                  get_menu_repo: c.MenuRepository) -> None:
+    monkeypatch.setitem(c.app.dependency_overrides, c.get_aioredis, lambda: get_test_redis)
+    assert (await async_client.get(d.ENDPOINT_MENU)).json()[0]['title'] == d.MENU_POST_PAYLOAD['title']
+    await get_test_redis.flushall()
+    await _rename_menu_in_db(get_menu_repo, 'Changed')
+    assert (await async_client.get(d.ENDPOINT_MENU)).json()[0]['title'] == 'Changed'
+    assert not await get_test_redis.keys('response:/*')
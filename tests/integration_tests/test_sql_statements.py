@@ -0,0 +1,45 @@
+import pytest
+from fastapi import status
+
+from tests import conftest as c
+from tests.fixtures import data as d
+
+pytestmark = c.pytest_mark_anyio
+
+DELETE, GET, POST, PATCH = 'DELETE', 'GET', 'POST', 'PATCH'
+MENU = f'{d.ENDPOINT_MENU}/{d.ID}'
+SUBMENU = f'{d.ENDPOINT_SUBMENU}/{d.ID}'
+DISH = f'{d.ENDPOINT_DISH}/{d.ID}'
+NEW = {'title': 'New', 'description': 'New description'}
+
+
+@pytest.mark.parametrize('method, endpoint, payload, expected', (
+    (GET, d.ENDPOINT_MENU, None, 1),
+    (GET, MENU, None, 1),
+    (POST, d.ENDPOINT_MENU, NEW, 2),
+    (PATCH, MENU, d.MENU_PATCH_PAYLOAD, 3),
+    (DELETE, MENU, None, 6),
+    (GET, d.ENDPOINT_FULL_LIST, None, 1),
+    (GET, d.ENDPOINT_SUBMENU, None, 1),
+    (GET, SUBMENU, None, 1),
+    # + the UPDATEs of the counts stored by the parents
+    (POST, d.ENDPOINT_SUBMENU, NEW, 5),
+    (PATCH, SUBMENU, d.SUBMENU_PATCH_PAYLOAD, 3),
+    (DELETE, SUBMENU, None, 6),
+    (GET, d.ENDPOINT_DISH, None, 1),
+    (GET, DISH, None, 1),
+    (POST, d.ENDPOINT_DISH, NEW, 7),
+    (PATCH, DISH, d.DISH_PATCH_PAYLOAD, 3),
+    (DELETE, DISH, None, 6),
+))
+async def test_sql_statements_per_route(dish: c.Response,
+                                        async_client: c.AsyncClient,
+                                        sql_statements: list[str],
+                                        method: str,
+                                        endpoint: str,
+                                        payload: dict | None,
+                                        expected: int) -> None:
+    """The cache is flushed after every request in tests, so each route hits the DB."""
+    response = await async_client.request(method, endpoint, json=payload)
+    assert response.status_code in (status.HTTP_200_OK, status.HTTP_201_CREATED), response.json()
+    assert len(sql_statements) == expected, sql_statements
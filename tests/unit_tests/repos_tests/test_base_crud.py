@@ -84,6 +84,20 @@ class TestCRUDBaseRepository:
         await self._create_object()
         self._check_obj(await method(1))
 
+    @pytest_mark_anyio
+    async def test_get_uses_identity_map(self, init, sql_statements: list[str]) -> None:
+        obj = await self._create_object()
+        sql_statements.clear()
+        assert await self.crud_base_not_implemented.get(obj.id) is obj
+        assert not sql_statements
+        assert await self.crud_base_not_implemented.get(obj.id, populate_existing=True) is obj
+        assert len(sql_statements) == 1
+
+    def test_query_by_attributes_is_built_once(self, init) -> None:
+        query = self.crud_base_not_implemented._get_query(('title',))
+        assert self.crud_base_implemented._get_query(('title',)) is query
+        assert self.crud_base_implemented._get_query(('title', 'description')) is not query
+
     @pytest_mark_anyio
     async def test_get_or_404(self, init) -> None:
         method = self.crud_base_not_implemented.get_or_404
@@ -174,6 +188,16 @@ class TestCRUDBaseRepository:
             await method(*args)
         check_exception_info(exc_info, expected_msg)
 
+    @pytest_mark_anyio
+    async def test_bulk_create_method(self, init) -> None:
+        method = self.crud_base_not_implemented.bulk_create
+        assert await method([]) == []
+        rows = [{'title': f'{self.post_payload["title"]} {i}', 'description': ''} for i in range(3)]
+        ids = await method(rows[::-1])
+        await self.crud_base_not_implemented.session.commit()
+        for id, row in zip(ids, rows[::-1]):
+            self._compare_obj_payload(await self.crud_base_not_implemented.get(id), {**row, 'description': ''})
+
     @pytest_mark_anyio
     async def test_delete_method(self, init) -> None:
         created = await self._create_object()
@@ -1,4 +1,7 @@
 import pytest
+from sqlalchemy import update
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import load_only, selectinload
 
 from app.repositories.db_repository import (
     CRUDRepository,
@@ -7,7 +10,7 @@ from app.repositories.db_repository import (
     SubmenuRepository,
 )
 from tests import conftest as c
-from tests.fixtures.data import Model
+from tests.fixtures.data import ID, Model
 from tests.utils import get_method
 
 
@@ -39,6 +42,46 @@ class TestMenuRepository:
         assert self.NOT_FOUND == self.repo_db.NOT_FOUND
         assert self.OBJECT_ALREADY_EXISTS == self.repo_db.OBJECT_ALREADY_EXISTS
 
+    @c.pytest_mark_anyio
+    async def test_get_all_counts_in_one_query(self, init, dish: c.Response, sql_statements: list[str]) -> None:
+        menus = await self.repo_db.get_all()
+        assert len(sql_statements) == 1
+        # the counts are stored columns, nothing is counted on read
+        assert 'count(' not in sql_statements[0]
+        assert (menus[0].submenus_count, menus[0].dishes_count) == (1, 1)
+        assert 'submenus' not in vars(menus[0])
+
+    @c.pytest_mark_anyio
+    async def test_get_loader_options(self, init, submenu: c.Response) -> None:
+        menu = await self.repo_db.get(ID, options=(load_only(c.Menu.id), selectinload(c.Menu.submenus)))
+        assert set(vars(menu)) == {'_sa_instance_state', 'id', 'submenus'}
+        assert len(menu.submenus) == 1
+
+    @c.pytest_mark_anyio
+    async def test_collections_are_not_lazy_loaded(self, init, submenu: c.Response) -> None:
+        menu = await self.repo_db.get(ID)
+        with pytest.raises(InvalidRequestError):
+            menu.submenus
+
+    @c.pytest_mark_anyio
+    async def test_get_tree_rows(self, init, dish: c.Response, get_test_session: c.AsyncSession,
+                                 sql_statements: list[str]) -> None:
+        get_test_session.add(c.Menu(title='Empty', description='Empty'))
+        await get_test_session.commit()
+        sql_statements.clear()
+        rows = await self.repo_db.get_tree_rows()
+        assert len(sql_statements) == 1
+        assert [(row.menu_id, row.submenu_id, row.dish_id) for row in rows] == [(ID, ID, ID), (ID + 1, None, None)]
+
+    @c.pytest_mark_anyio
+    async def test_recount(self, init, dish: c.Response, get_test_session: c.AsyncSession) -> None:
+        await get_test_session.execute(update(c.Menu).values(submenus_count=5))
+        assert await self.repo_db.recount([ID + 1]) == []
+        assert await self.repo_db.recount() == [ID]
+        assert await self.repo_db.recount() == []
+        menu = await self.repo_db.get(ID, populate_existing=True)
+        assert (menu.submenus_count, menu.dishes_count) == (1, 1)
+
 
 class TestSubmenuRepository:
     NOT_FOUND = 'submenu not found'
@@ -58,6 +101,22 @@ class TestSubmenuRepository:
         self.repo_db.perform_create(create_data, 'menu.id')
         assert create_data['menu_id'] == 'menu.id'
 
+    @c.pytest_mark_anyio
+    async def test_recount(self, init, dish: c.Response, get_test_session: c.AsyncSession) -> None:
+        await get_test_session.execute(update(c.Submenu).values(dishes_count=5))
+        assert await self.repo_db.recount() == [ID]
+        assert (await self.repo_db.get(ID, populate_existing=True)).dishes_count == 1
+
+    @c.pytest_mark_anyio
+    async def test_create_delete_update_counts(self, init, dish: c.Response, get_menu_repo: c.MenuRepository) -> None:
+        submenu = await self.repo_db.create(c.SubmenuIn(title='New', description='New'), extra_data=ID)
+        menu = await get_menu_repo.get(ID, populate_existing=True)
+        assert (menu.submenus_count, menu.dishes_count) == (2, 1)
+        await self.repo_db.delete(ID)
+        menu = await get_menu_repo.get(ID, populate_existing=True)
+        assert (menu.submenus_count, menu.dishes_count) == (1, 0)
+        assert submenu.dishes_count == 0
+
 
 class TestDishRepository:
     NOT_FOUND = 'dish not found'
@@ -76,3 +135,32 @@ class TestDishRepository:
         create_data = {}
         self.repo_db.perform_create(create_data, 'submenu.id')
         assert create_data['submenu_id'] == 'submenu.id'
+
+    @c.pytest_mark_anyio
+    async def test_create_delete_update_counts(self, init, dish: c.Response, get_menu_repo: c.MenuRepository,
+                                               get_test_session: c.AsyncSession) -> None:
+        await self.repo_db.create(c.DishIn(title='New', description='New', price='1'), extra_data=ID)
+        menu = await get_menu_repo.get(ID, populate_existing=True)
+        submenu = await SubmenuRepository(get_test_session).get(ID, populate_existing=True)
+        assert (menu.dishes_count, submenu.dishes_count) == (2, 2)
+        await self.repo_db.delete(ID)
+        await get_test_session.refresh(menu)
+        await get_test_session.refresh(submenu)
+        assert (menu.dishes_count, submenu.dishes_count) == (1, 1)
+
+    @c.pytest_mark_anyio
+    async def test_list_by_submenu(self, init, dish: c.Response, sql_statements: list[str]) -> None:
+        dishes = await self.repo_db.list_by_submenu(ID, ID)
+        assert [(dish.id, dish.menu_id) for dish in dishes] == [(ID, ID)]
+        assert len(sql_statements) == 1
+        # the menu is taken from the joined submenu rather than looked up for every row
+        assert '(SELECT' not in sql_statements[0]
+        # the submenu does not belong to the menu
+        assert await self.repo_db.list_by_submenu(ID, ID + 1) is None
+        assert await self.repo_db.list_by_submenu(ID, ID, after=ID) is None
+
+    @c.pytest_mark_anyio
+    async def test_reads_fill_menu_id(self, init, dish: c.Response) -> None:
+        assert (await self.repo_db.get(ID)).menu_id == ID
+        assert [dish.menu_id for dish in await self.repo_db.get_all()] == [ID]
+        assert [dish.menu_id for dish in await self.repo_db.get_many([ID], populate_existing=True)] == [ID]
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+
+import pytest
+
+from app.repositories.local_cache import INVALIDATE_CHANNEL, LocalCache
+from app.repositories.redis_repository import RedisBaseRepository
+from tests import conftest as c
+from tests.utils import silent_redis
+
+
+def test_lru_bounded_by_entries() -> None:
+    cache = LocalCache(max_entries=2)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    assert cache.get('a') == b'1'
+    cache.set('c', b'3')
+    # `b` is the least recently used
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (b'1', b'3')
+    assert cache.stats() == {'l1_entries': 2, 'l1_bytes': 2, 'l1_hits': 3, 'l1_misses': 1}
+
+
+def test_lru_bounded_by_bytes() -> None:
+    cache = LocalCache(max_bytes=4)
+    cache.set('a', b'12')
+    cache.set('b', b'34')
+    cache.set('c', b'5')
+    assert cache.get('a') is None
+    assert cache.size == 3
+    # a value larger than the whole cache is not kept
+    cache.set('b', b'12345')
+    assert cache.get('b') is None
+    assert cache.size == 1
+
+
+def test_ttl(monkeypatch) -> None:
+    cache = LocalCache(ttl=5)
+    cache.set('a', b'1')
+    monkeypatch.setattr('app.repositories.local_cache.monotonic', lambda: 2 ** 40)
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+@c.pytest_mark_anyio
+async def test_listen_drops_published_keys(get_test_redis: c.FakeRedis) -> None:
+    cache = LocalCache()
+    listener = asyncio.create_task(cache.listen(get_test_redis))
+    await asyncio.sleep(0.1)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    await get_test_redis.publish(INVALIDATE_CHANNEL, 'a')
+    for _ in range(50):
+        if cache.get('a') is None:
+            break
+        await asyncio.sleep(0.01)
+    listener.cancel()
+    assert cache.get('a') is None
+    assert cache.get('b') == b'2'
+
+
+@c.pytest_mark_anyio
+async def test_listen_keeps_cache_on_silent_channel(caplog: pytest.LogCaptureFixture) -> None:
+    cache = LocalCache()
+    async with silent_redis(socket_timeout=0.1) as redis:
+        listener = asyncio.create_task(cache.listen(redis))
+        await asyncio.sleep(0.1)
+        cache.set('a', b'1')
+        # several socket timeouts without messages
+        await asyncio.sleep(0.5)
+        listener.cancel()
+    assert cache.get('a') == b'1'
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+
+
+@c.pytest_mark_anyio
+async def test_repository_reads_through_local_cache(get_test_redis: c.FakeRedis) -> None:
+    redis = RedisBaseRepository(get_test_redis, 'menu:', local_cache=LocalCache())
+    menus = [c.Menu(id=id, title=f'menu {id}', description='', submenus_count=0, dishes_count=0) for id in (1, 2, 3)]
+    await redis.set_all(menus)
+    assert [menu.id for menu in await redis.get_all()] == [1, 2, 3]
+    # served locally without Redis
+    await get_test_redis.flushall()
+    assert [menu.id for menu in await redis.get_all(limit=2)] == [1, 2]
+    assert [menu.id for menu in await redis.get_all(limit=2, after=1)] == [2, 3]
+    assert (await redis.get_obj(3)).id == 3
+    # a write drops the changed keys
+    await redis.delete_obj(menus[0])
+    assert await redis.get_all() is None
+    assert await redis.get_obj(1) is None
+    assert (await redis.get_obj(2)).id == 2
@@ -1,9 +1,15 @@
-from time import sleep
+from time import sleep, time
 from typing import Any
 import pytest
 import pytest_asyncio
 
-from app.repositories.redis_repository import RedisBaseRepository
+from app.repositories.redis_repository import (
+    RedisBaseRepository,
+    RedisCatalogueRepository,
+    RedisLock,
+    RedisResponseRepository,
+    RedisVersionRepository,
+)
 from tests import conftest as c
 from tests.utils import compare, get_method
 
@@ -43,6 +49,8 @@ class TestBaseRedis:
         ('set_obj', 'obj_from_db'),
         ('set_all', '[obj_from_db]'),
         ('delete_obj', 'obj_from_db'),
+        ('set_many', '[obj_from_db]'),
+        ('delete_many', '[obj_from_db]'),
     ))
     @c.pytest_mark_anyio
     async def test_methods_return_None(self, init, obj_from_db: c.Menu, method_name: str, method_param: str) -> None:
@@ -59,6 +67,9 @@ class TestBaseRedis:
 
     @c.pytest_mark_anyio
     async def test_get_all_returns_list_objs(self, init, obj_from_db: c.Menu, set_obj_get_from_redis: c.Menu) -> None:
+        # objects cached one by one are not taken for the whole list
+        assert await self.redis.get_all() is None
+        await self.redis.set_all([obj_from_db])
         objs = await self.redis.get_all()
         assert isinstance(objs, list)
         for obj in objs:
@@ -76,6 +87,30 @@ class TestBaseRedis:
         sleep(1)
         assert await self.redis.get_obj(obj.id) is None
 
+    @c.pytest_mark_anyio
+    async def test_expire_jitter(self, get_test_redis: c.FakeRedis, obj_from_db: c.Menu) -> None:
+        self.redis = RedisBaseRepository(get_test_redis, self.prefix, redis_expire=100, expire_jitter=0.5)
+        await self.redis.set_all([obj_from_db])
+        assert 100 - 1 <= await get_test_redis.ttl(self.redis._get_key(obj_from_db.id)) <= 150
+        assert 100 - 1 <= await get_test_redis.ttl(self.redis.redis_index_key) <= 150
+
+    @c.pytest_mark_anyio
+    async def test_soft_expire(self, get_test_redis: c.FakeRedis, obj_from_db: c.Menu, monkeypatch) -> None:
+        self.redis = RedisBaseRepository(get_test_redis, self.prefix, soft_expire=10)
+        await self.redis.set_all([obj_from_db])
+        assert (await self.redis.get_obj_stale(obj_from_db.id))[1] is False
+        assert (await self.redis.get_all_stale())[1] is False
+        now = time()
+        monkeypatch.setattr('app.repositories.redis_repository.time', lambda: now + 11)
+        obj, stale = await self.redis.get_obj_stale(obj_from_db.id)
+        assert (obj.id, stale) == (obj_from_db.id, True)
+        objs, stale = await self.redis.get_all_stale()
+        assert ([obj.id for obj in objs], stale) == ([obj_from_db.id], True)
+        # without the soft expiry nothing is stale
+        self.redis.soft_expire = 0
+        await self.redis.set_obj(obj_from_db)
+        assert (await self.redis.get_obj_stale(obj_from_db.id))[1] is False
+
     @c.pytest_mark_anyio
     async def test_delete_obj(self, init, set_obj_get_from_redis: c.Menu) -> None:
         obj = set_obj_get_from_redis
@@ -96,8 +131,254 @@ class TestBaseRedis:
         assert len(objs) == len(lst)
         compare(objs[0], obj_from_db)
 
+    @c.pytest_mark_anyio
+    async def test_get_all_uses_index(self, init, obj_from_db: c.Menu) -> None:
+        await self.redis.set_all([obj_from_db])
+        assert await self.redis.redis.zrange(self.redis.redis_index_key, 0, -1) == [b'*', b'1']
+        assert await self.redis.delete_obj(obj_from_db) is None
+        assert await self.redis.redis.zrange(self.redis.redis_index_key, 0, -1) == [b'*']
+        assert await self.redis.get_all() is None
+
+    @c.pytest_mark_anyio
+    async def test_get_all_returns_None_if_obj_expired(self, init, obj_from_db: c.Menu) -> None:
+        await self.redis.set_all([obj_from_db])
+        await self.redis.redis.delete(self.redis._get_key(obj_from_db.id))
+        assert await self.redis.get_all() is None
+
+    @c.pytest_mark_anyio
+    async def test_set_obj_keeps_complete_index(self, init, obj_from_db: c.Menu) -> None:
+        await self.redis.set_all([obj_from_db])
+        other = c.Menu(id=obj_from_db.id + 1, title='other', description='other')
+        await self.redis.set_obj(other)
+        assert [obj.id for obj in await self.redis.get_all()] == [obj_from_db.id, other.id]
+
+    @c.pytest_mark_anyio
+    async def test_set_many_delete_many(self, init, obj_from_db: c.Menu) -> None:
+        other = c.Menu(id=obj_from_db.id + 1, title='other', description='other')
+        await self.redis.set_many([obj_from_db, other])
+        for obj in (obj_from_db, other):
+            compare(await self.redis.get_obj(obj.id), obj)
+        await self.redis.delete_many([obj_from_db, other], transaction=True)
+        for obj in (obj_from_db, other):
+            assert await self.redis.get_obj(obj.id) is None
+
+    @c.pytest_mark_anyio
+    async def test_set_many_delete_many_queue_into_pipeline(self, init, obj_from_db: c.Menu) -> None:
+        async with self.redis.pipeline() as pipe:
+            await self.redis.set_many([obj_from_db], pipe)
+            assert await self.redis.get_obj(obj_from_db.id) is None
+            await pipe.execute()
+        compare(await self.redis.get_obj(obj_from_db.id), obj_from_db)
+        async with self.redis.pipeline() as pipe:
+            await self.redis.delete_many([obj_from_db], pipe)
+            assert await self.redis.get_obj(obj_from_db.id) is not None
+            await pipe.execute()
+        assert await self.redis.get_obj(obj_from_db.id) is None
+
+    @c.pytest_mark_anyio
+    async def test_get_all_returns_page(self, init, obj_from_db: c.Menu) -> None:
+        others = [c.Menu(id=obj_from_db.id + i, title=f'other {i}', description='other') for i in (1, 2)]
+        await self.redis.set_all([obj_from_db, *others])
+        assert [obj.id for obj in await self.redis.get_all(limit=2)] == [obj_from_db.id, others[0].id]
+        assert [obj.id for obj in await self.redis.get_all(limit=2, after=others[0].id)] == [others[1].id]
+        assert await self.redis.get_all(limit=2, after=others[1].id) is None
+
+    @c.pytest_mark_anyio
+    async def test_get_all_by_parent(self, get_test_redis: c.FakeRedis) -> None:
+        self.redis = RedisBaseRepository(get_test_redis, self.prefix, parent_attrs=('menu_id',))
+        submenus = [c.Submenu(id=id, title=f'submenu {id}', description='', menu_id=menu_id, dishes_count=0)
+                    for id, menu_id in ((1, 1), (2, 2), (3, 1))]
+        await self.redis.set_all([submenu for submenu in submenus if submenu.menu_id == 1], parent_id=(1,))
+        assert [obj.id for obj in await self.redis.get_all(parent_id=(1,))] == [1, 3]
+        assert await self.redis.get_all() is None
+        assert await self.redis.get_all(parent_id=(2,)) is None
+        await self.redis.delete_obj(submenus[0])
+        assert [obj.id for obj in await self.redis.get_all(parent_id=(1,))] == [3]
+
+    @c.pytest_mark_anyio
+    async def test_set_all_with_parents(self, get_test_redis: c.FakeRedis) -> None:
+        self.redis = RedisBaseRepository(get_test_redis, self.prefix, parent_attrs=('menu_id',))
+        submenus = [c.Submenu(id=id, title=f'submenu {id}', description='', menu_id=menu_id, dishes_count=0)
+                    for id, menu_id in ((1, 1), (2, 2), (3, 1))]
+        # a stale id in the index of a parent is dropped
+        await get_test_redis.zadd(self.redis._get_index_key((2,)), {4: 4})
+        async with self.redis.pipeline() as pipe:
+            await self.redis.set_all_with_parents(submenus, pipe)
+            await pipe.execute()
+        assert [obj.id for obj in await self.redis.get_all()] == [1, 2, 3]
+        assert [obj.id for obj in await self.redis.get_all(parent_id=(1,))] == [1, 3]
+        assert [obj.id for obj in await self.redis.get_all(parent_id=(2,))] == [2]
+
     @pytest.mark.parametrize('suffix', (1, 1.2, '1', [1, 2], (1, 2), {1, 1, 2}, {'1': 300}))
     def test_get_key(self, init, suffix: Any) -> None:
         key = self.redis._get_key(suffix)
         assert isinstance(key, str)
         assert key == f'{self.prefix}{suffix}'
+
+
+class TestResponseRedis:
+    path = '/api/v1/menus'
+    body = b'[{"id":"1"}]'
+    redis: RedisResponseRepository
+
+    @pytest.fixture
+    def init(self, get_test_redis: c.FakeRedis) -> None:
+        self.redis = RedisResponseRepository(get_test_redis)
+
+    @c.pytest_mark_anyio
+    async def test_get_returns_None_and_generation(self, init) -> None:
+        assert await self.redis.get(self.path) == (None, 0)
+
+    @c.pytest_mark_anyio
+    async def test_set_get(self, init) -> None:
+        await self.redis.set(self.path, self.body, 0)
+        assert await self.redis.get(self.path) == (self.body, 0)
+
+    @c.pytest_mark_anyio
+    async def test_invalidate(self, init) -> None:
+        await self.redis.set(self.path, self.body, 0)
+        async with self.redis.redis.pipeline() as pipe:
+            self.redis.invalidate(pipe)
+            await pipe.execute()
+        assert await self.redis.get(self.path) == (None, 1)
+
+    @c.pytest_mark_anyio
+    async def test_body_of_old_generation_is_ignored(self, init) -> None:
+        body, generation = await self.redis.get(self.path)
+        await self.redis.redis.incr(self.redis.GENERATION_KEY)
+        await self.redis.set(self.path, self.body, generation)
+        assert await self.redis.get(self.path) == (None, 1)
+
+
+class TestVersionRedis:
+
+    async def _bump(self, versions: RedisVersionRepository, *entities: str) -> None:
+        async with versions.redis.pipeline() as pipe:
+            versions.bump(pipe, *entities)
+            await pipe.execute()
+
+    @c.pytest_mark_anyio
+    async def test_get_is_stable(self, get_test_redis: c.FakeRedis) -> None:
+        versions = RedisVersionRepository(get_test_redis)
+        assert await versions.get('menu') == await versions.get('menu:') > 0
+
+    @c.pytest_mark_anyio
+    async def test_bump_changes_only_given_entities(self, get_test_redis: c.FakeRedis) -> None:
+        versions = RedisVersionRepository(get_test_redis)
+        menu, dish = await versions.get('menu'), await versions.get('dish')
+        await self._bump(versions, 'menu:', 'menu')
+        assert await versions.get('menu') == menu + 1
+        assert await versions.get('dish') == dish
+
+    @c.pytest_mark_anyio
+    async def test_lost_version_is_not_reused(self, get_test_redis: c.FakeRedis) -> None:
+        versions = RedisVersionRepository(get_test_redis)
+        await self._bump(versions, 'menu')
+        version = await versions.get('menu')
+        await get_test_redis.flushall()
+        await self._bump(versions, 'menu')
+        assert await versions.get('menu') > version
+
+
+class TestCatalogueRedis:
+    catalogue: RedisCatalogueRepository
+
+    @pytest.fixture
+    def init(self, get_test_redis: c.FakeRedis) -> None:
+        self.catalogue = RedisCatalogueRepository(get_test_redis, max_versions=3)
+
+    async def _record(self, changed: dict = {}, deleted: dict = {}, reset: bool = False) -> None:
+        async with self.catalogue.redis.pipeline() as pipe:
+            version, start = await self.catalogue.watch(pipe)
+            pipe.multi()
+            self.catalogue.record(pipe, version, start, changed, deleted, reset)
+            await pipe.execute()
+
+    @c.pytest_mark_anyio
+    async def test_version_is_kept(self, init) -> None:
+        version = await self.catalogue.get_version()
+        assert await self.catalogue.get_version() == version
+        assert await self.catalogue.get_changes(version) == (version, {}, {})
+
+    @c.pytest_mark_anyio
+    async def test_read_keeps_version_written_meanwhile(self, init, monkeypatch: pytest.MonkeyPatch) -> None:
+        redis = self.catalogue.redis
+        version = await self.catalogue.get_version()
+        await self._record({'menu:': [1]})
+        mget = redis.mget
+
+        async def mget_before_write(*keys):
+            monkeypatch.setattr(redis, 'mget', mget)
+            return [None, None]
+
+        monkeypatch.setattr(redis, 'mget', mget_before_write)
+        assert await self.catalogue.get_version() == version + 1
+        assert int(await redis.get(self.catalogue.VERSION_KEY)) == version + 1
+        await self._record({'menu:': [2]})
+        assert await self.catalogue.get_changes(version + 1) == (version + 2, {'menu': ['2']}, {})
+
+    @c.pytest_mark_anyio
+    async def test_changes_since_version(self, init) -> None:
+        version = await self.catalogue.get_version()
+        await self._record({'menu:': [1, 2]})
+        await self._record({'dish:': [3]}, {'menu:': [2]})
+        assert await self.catalogue.get_changes(version) == (version + 2, {'menu': ['1'], 'dish': ['3']},
+                                                             {'menu': ['2']})
+        assert await self.catalogue.get_changes(version + 1) == (version + 2, {'dish': ['3']}, {'menu': ['2']})
+        assert await self.catalogue.get_changes(version + 2) == (version + 2, {}, {})
+
+    @c.pytest_mark_anyio
+    async def test_unknown_versions_need_reload(self, init) -> None:
+        version = await self.catalogue.get_version()
+        for since in (version - 1, version + 1):
+            assert await self.catalogue.get_changes(since) == (version, None, None)
+
+    @c.pytest_mark_anyio
+    async def test_log_keeps_max_versions(self, init) -> None:
+        version = await self.catalogue.get_version()
+        for id in range(5):
+            await self._record({'menu:': [id]})
+        assert await self.catalogue.get_changes(version + 1) == (version + 5, None, None)
+        assert await self.catalogue.get_changes(version + 2) == (version + 5, {'menu': ['2', '3', '4']}, {})
+        assert await self.catalogue.redis.zcard(self.catalogue.CHANGES_KEY) == 3
+
+    @c.pytest_mark_anyio
+    async def test_reset(self, init) -> None:
+        version = await self.catalogue.get_version()
+        await self._record(reset=True)
+        assert await self.catalogue.get_changes(version) == (version + 1, None, None)
+        assert await self.catalogue.get_changes(version + 1) == (version + 1, {}, {})
+
+    @c.pytest_mark_anyio
+    async def test_lost_version_needs_reload(self, init) -> None:
+        await self._record({'menu:': [1]})
+        version = await self.catalogue.get_version()
+        await self.catalogue.redis.flushall()
+        sleep(0.002)
+        new_version, changed, _ = await self.catalogue.get_changes(version)
+        assert new_version > version
+        assert changed is None
+
+
+class TestRedisLock:
+    key = 'lock'
+
+    @c.pytest_mark_anyio
+    async def test_lock_is_taken_once(self, get_test_redis: c.FakeRedis) -> None:
+        lock, other = RedisLock(get_test_redis, self.key), RedisLock(get_test_redis, self.key)
+        assert await lock.acquire()
+        assert not await other.acquire()
+        await lock.release()
+        assert await other.acquire()
+
+    @c.pytest_mark_anyio
+    async def test_lock_expires(self, get_test_redis: c.FakeRedis) -> None:
+        assert await RedisLock(get_test_redis, self.key, timeout=10).acquire()
+        assert 0 < await get_test_redis.ttl(self.key) <= 10
+
+    @c.pytest_mark_anyio
+    async def test_release_by_not_owner_keeps_lock(self, get_test_redis: c.FakeRedis) -> None:
+        lock, other = RedisLock(get_test_redis, self.key), RedisLock(get_test_redis, self.key)
+        assert await lock.acquire()
+        await other.release()
+        assert await get_test_redis.get(self.key) == lock.token
@@ -0,0 +1,36 @@
+import orjson
+import pytest
+
+from app.repositories.serializers import PickleSerializer, SchemaSerializer
+from tests import conftest as c
+from tests.fixtures import data as d
+from tests.utils import compare
+
+
+@pytest.fixture
+def menu() -> c.Menu:
+    return c.Menu(id=d.ID, **d.MENU_POST_PAYLOAD, submenus_count=0, dishes_count=0)
+
+
+def test_pickle_serializer(menu: c.Menu) -> None:
+    serializer = PickleSerializer()
+    compare(serializer.loads(serializer.dumps(menu)), menu)
+
+
+def test_schema_serializer_stores_response_shape(menu: c.Menu) -> None:
+    data = SchemaSerializer(c.MenuOut).dumps(menu)
+    assert isinstance(data, bytes)
+    assert orjson.loads(data) == d.CREATED_MENU
+
+
+def test_schema_serializer_loads_schema(menu: c.Menu) -> None:
+    serializer = SchemaSerializer(c.MenuOut)
+    obj = serializer.loads(serializer.dumps(menu))
+    assert isinstance(obj, c.MenuOut)
+    assert obj.dict() == d.CREATED_MENU
+    compare(obj, menu)
+
+
+def test_schema_serializer_dumps_schema(menu: c.Menu) -> None:
+    serializer = SchemaSerializer(c.MenuOut)
+    assert serializer.dumps(c.MenuOut.from_orm(menu)) == serializer.dumps(menu)
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+
+import orjson
+import pytest
+from fastapi import HTTPException, status
+
+from app.repositories.redis_repository import RedisCatalogueRepository
+from app.services.change_stream import ChangeStream, Subscriber
+from app.services.services import CatalogueService
+from tests import conftest as c
+from tests.utils import silent_redis
+
+pytestmark = c.pytest_mark_anyio
+
+TIMEOUT = 1
+
+
+async def _record(redis: c.FakeRedis, changed: dict) -> int:
+    catalogue = RedisCatalogueRepository(redis)
+    async with redis.pipeline() as pipe:
+        version, start = await catalogue.watch(pipe)
+        pipe.multi()
+        catalogue.record(pipe, version, start, changed, {})
+        await pipe.execute()
+    return version + 1
+
+
+def _event(version: int) -> bytes:
+    return orjson.dumps({'version': version, 'reload': False, 'changed': {'menu': ['1']}, 'deleted': {}})
+
+
+async def test_subscriber_overflow_turns_into_reload() -> None:
+    subscriber = Subscriber(buffer_size=2)
+    for version in range(1, 4):
+        subscriber.put(version, _event(version))
+    assert subscriber.dropped == 2
+    version, data = subscriber.queue.get_nowait()
+    assert version == 3
+    assert orjson.loads(data) == {'version': 3, 'reload': True, 'changed': {}, 'deleted': {}}
+    assert subscriber.queue.empty()
+
+
+async def test_publish_fans_out() -> None:
+    stream = ChangeStream()
+    subscribers = [Subscriber(1), Subscriber(1)]
+    stream.subscribers.update(subscribers)
+    stream.publish(_event(1))
+    for subscriber in subscribers:
+        assert subscriber.queue.get_nowait() == (1, _event(1))
+
+
+async def test_events_format_and_ping() -> None:
+    stream = ChangeStream(ping_interval=0.01)
+    subscriber = Subscriber(1)
+    stream.subscribers.add(subscriber)
+    events = stream.events(subscriber, first=_event(1))
+    assert await anext(events) == b'id: 1\nevent: change\ndata: %b\n\n' % _event(1)
+    assert await anext(events) == b': ping\n\n'
+    subscriber.put(2, _event(2))
+    assert await anext(events) == b'id: 2\nevent: change\ndata: %b\n\n' % _event(2)
+    await events.aclose()
+    assert not stream.subscribers
+
+
+async def test_subscriber_gets_published_changes(get_test_redis: c.FakeRedis) -> None:
+    stream = ChangeStream()
+    try:
+        subscriber = await stream.subscribe(get_test_redis)
+        version = await _record(get_test_redis, {'menu:': [1]})
+        assert await asyncio.wait_for(subscriber.queue.get(), TIMEOUT) == (version, _event(version))
+    finally:
+        await stream.close()
+
+
+async def test_idle_subscriber_gets_no_events(caplog: pytest.LogCaptureFixture) -> None:
+    stream = ChangeStream()
+    async with silent_redis(socket_timeout=0.1) as redis:
+        try:
+            subscriber = await stream.subscribe(redis)
+            # several socket timeouts without changes
+            await asyncio.sleep(0.5)
+        finally:
+            await stream.close()
+    assert subscriber.queue.empty()
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+
+
+async def test_subscribe_over_max_subscribers(get_test_redis: c.FakeRedis) -> None:
+    with pytest.raises(HTTPException) as exc_info:
+        await ChangeStream(max_subscribers=0).subscribe(get_test_redis)
+    assert exc_info.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+async def test_stream_catches_up_from_last_event_id(get_test_redis: c.FakeRedis) -> None:
+    stream = ChangeStream()
+    service = CatalogueService(get_test_redis, stream)
+    try:
+        version = (await service.get_version())['version']
+        await _record(get_test_redis, {'menu:': [1]})
+        events = await service.stream(last_event_id=version)
+        event = await anext(events)
+        assert event.startswith(b'id: %d\nevent: change\ndata: ' % (version + 1))
+        assert orjson.loads(event.split(b'data: ')[1])['changed']['menu'] == ['1']
+        await events.aclose()
+        assert not stream.subscribers
+    finally:
+        await stream.close()
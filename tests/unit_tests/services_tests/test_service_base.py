@@ -1,8 +1,11 @@
+import asyncio
+
 import pytest
 import pytest_asyncio
-from fastapi import HTTPException
+from fastapi import BackgroundTasks, HTTPException
 
-from app.repositories.redis_repository import RedisBaseRepository
+from app.core import settings
+from app.repositories.redis_repository import RedisBaseRepository, RedisLock
 from app.services.services import BaseService
 from tests import conftest as c
 from tests.fixtures import data as d
@@ -34,6 +37,9 @@ class TestBaseService:
         cache = await self.base_service.redis.get_all()
         compare_lists(db, cache)
 
+    async def _check_cached_obj(self, obj: d.Model) -> None:
+        compare(await self.base_service.redis.get_obj(obj.id), obj)
+
     @pytest_asyncio.fixture
     async def init(self, get_test_session: c.AsyncSession, get_test_redis: c.FakeRedis) -> None:
         self.base_service = BaseService(CRUD(self.model, get_test_session),
@@ -51,8 +57,9 @@ class TestBaseService:
     async def test_set_cache_obj(self, get_obj_from_db: d.Model) -> None:
         assert await self._cache_empty()
         await self.base_service.set_cache(get_obj_from_db)
-        assert not await self._cache_empty()
-        await self._check_cache_equals_db()
+        # a single object does not make the cached list complete
+        assert await self._cache_empty()
+        await self._check_cached_obj(get_obj_from_db)
 
     async def test_set_cache_objs(self, get_obj_from_db: d.Model) -> None:
         assert await self._cache_empty()
@@ -60,6 +67,54 @@ class TestBaseService:
         assert not await self._cache_empty()
         await self._check_cache_equals_db()
 
+    async def test_cache_batch(self, get_obj_from_db: d.Model, get_test_redis: c.FakeRedis) -> None:
+        other_redis = RedisBaseRepository(get_test_redis, 'other:')
+        await other_redis.set_obj(get_obj_from_db)
+        await self.base_service._cache_batch(set=((self.base_service.redis, [get_obj_from_db]),),
+                                             delete=((other_redis, [get_obj_from_db]),))
+        await self._check_cached_obj(get_obj_from_db)
+        assert await other_redis.get_obj(get_obj_from_db.id) is None
+
+    async def test_cache_batch_logs_catalogue_changes(self, get_obj_from_db: d.Model,
+                                                      get_test_redis: c.FakeRedis) -> None:
+        catalogue = self.base_service.catalogue
+        version = await catalogue.get_version()
+        other_redis = RedisBaseRepository(get_test_redis, 'other:')
+        await self.base_service._cache_batch(set=((self.base_service.redis, [get_obj_from_db]),),
+                                             delete=((other_redis, [get_obj_from_db]),))
+        entity, id = self.base_service.redis.redis_key_prefix.rstrip(':'), str(get_obj_from_db.id)
+        assert await catalogue.get_changes(version) == (version + 1, {entity: [id]}, {'other': [id]})
+
+    async def test_cache_batch_skips_empty_lists(self, get_obj_from_db: d.Model, get_test_redis: c.FakeRedis) -> None:
+        catalogue, versions = self.base_service.catalogue, self.base_service.versions
+        version = await catalogue.get_version()
+        other_redis = RedisBaseRepository(get_test_redis, 'other:')
+        other_version = await versions.get('other')
+        await self.base_service._cache_batch(set=((self.base_service.redis, []), (other_redis, [])))
+        assert await catalogue.get_version() == version
+        await self.base_service._cache_batch(set=((self.base_service.redis, [get_obj_from_db]), (other_redis, [])))
+        assert await catalogue.get_version() == version + 1
+        assert await versions.get('other') == other_version
+
+    async def test_cache_batch_retries_after_concurrent_write(self, get_obj_from_db: d.Model,
+                                                              get_test_redis: c.FakeRedis, monkeypatch) -> None:
+        catalogue = self.base_service.catalogue
+        version = await catalogue.get_version()
+        watch, watched = catalogue.watch, []
+
+        async def watch_and_write(pipe):
+            result = await watch(pipe)
+            if not watched:
+                await get_test_redis.incr(catalogue.VERSION_KEY)
+            watched.append(result)
+            return result
+
+        monkeypatch.setattr(catalogue, 'watch', watch_and_write)
+        await self.base_service._cache_batch(set=((self.base_service.redis, [get_obj_from_db]),))
+        assert [v for v, _ in watched] == [version, version + 1]
+        assert await catalogue.get_version() == version + 2
+        await self._check_cached_obj(get_obj_from_db)
+
     async def test_get_all_returns_None(self, init) -> None:
         assert await self._cache_empty()
         assert await self.base_service.get_all() is None
@@ -88,12 +143,110 @@ class TestBaseService:
         compare(objs_db[0], get_obj_from_db)
         compare(objs_cache[0], get_obj_from_db)
 
+    async def test_get_page(self, init) -> None:
+        objs = [await self.base_service.db._save(self.model(title=f'{self.post_payload["title"]} {i}',
+                                                             description=self.post_payload['description']))
+                for i in range(3)]
+        ids = [obj.id for obj in objs]
+        page, next_cursor = await self.base_service.get_page(2)
+        assert [obj.id for obj in page] == ids[:2]
+        assert next_cursor == ids[1]
+        # a part of the list does not make the cached list complete
+        assert await self._cache_empty()
+        assert (await self.base_service.redis.get_obj(ids[2])).id == ids[2]
+        page, next_cursor = await self.base_service.get_page(2, after=next_cursor)
+        assert [obj.id for obj in page] == ids[2:]
+        assert next_cursor is None
+        assert await self.base_service.get_page(2, after=ids[2]) == ([], None)
+
+    async def test_get_page_with_whole_list_fills_cache(self, get_obj_from_db: d.Model) -> None:
+        page, next_cursor = await self.base_service.get_page(2)
+        assert [obj.id for obj in page] == [get_obj_from_db.id]
+        assert next_cursor is None
+        await self._check_cache_equals_db()
+
+    async def test_concurrent_misses_share_one_query(self, get_obj_from_db: d.Model, monkeypatch) -> None:
+        calls = []
+        get = self.base_service.db.get
+
+        async def counted_get(*args, **kwargs):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return await get(*args, **kwargs)
+
+        monkeypatch.setattr(self.base_service.db, 'get', counted_get)
+        objs = await asyncio.gather(*(self.base_service.get(get_obj_from_db.id) for _ in range(5)))
+        assert [obj.id for obj in objs] == [get_obj_from_db.id] * 5
+        assert len(calls) == 1
+        # the next miss queries the DB again
+        await self.base_service.redis.delete_obj(get_obj_from_db)
+        await self.base_service.get(get_obj_from_db.id)
+        assert len(calls) == 2
+
+    async def test_concurrent_misses_share_exception(self, get_obj_from_db: d.Model) -> None:
+        results = await asyncio.gather(*(self.base_service.get_or_404(get_obj_from_db.id + 1) for _ in range(2)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, HTTPException) for result in results)
+
+    async def test_cache_lock_owner_fills_cache(self, get_obj_from_db: d.Model, monkeypatch) -> None:
+        monkeypatch.setattr(settings, 'cache_lock', True)
+        await self.base_service.get(get_obj_from_db.id)
+        await self._check_cached_obj(get_obj_from_db)
+        assert await self.base_service.redis.redis.get(f'lock:{self.base_service.redis._get_key(get_obj_from_db.id)}'
+                                                       ) is None
+
+    async def test_cache_lock_waits_for_cache(self, get_obj_from_db: d.Model, monkeypatch) -> None:
+        monkeypatch.setattr(settings, 'cache_lock', True)
+        monkeypatch.setattr(settings, 'cache_lock_wait', 0.01)
+        monkeypatch.setattr(settings, 'cache_lock_retries', 2)
+        redis = self.base_service.redis
+        assert await RedisLock(redis.redis, f'lock:{redis._get_key(get_obj_from_db.id)}').acquire()
+        # the cache is not filled in time by the owner of the lock
+        assert (await self.base_service.get(get_obj_from_db.id)).id == get_obj_from_db.id
+
+        async def db_get(*args, **kwargs):
+            raise AssertionError('The DB should not be queried')
+
+        other = d.Model(id=get_obj_from_db.id, title='cached by the owner of the lock', description='')
+        monkeypatch.setattr(self.base_service.db, 'get', db_get)
+        await redis.delete_obj(get_obj_from_db)
+        task = asyncio.ensure_future(self.base_service.get(get_obj_from_db.id))
+        await redis.set_obj(other)
+        assert (await task).title == other.title
+
+    async def test_stale_obj_is_served_and_refreshed(self, get_obj_from_db: d.Model, monkeypatch) -> None:
+        redis = self.base_service.redis
+        stale = d.Model(id=get_obj_from_db.id, title='stale', description='')
+        redis.soft_expire = 1
+        gets = (
+            lambda: self.base_service.get(stale.id),
+            lambda: self.base_service.get_all(),
+            lambda: self.base_service.get_page(1),
+        )
+        for get, get_title in zip(gets, (lambda obj: obj.title, lambda objs: objs[0].title,
+                                         lambda page: page[0][0].title)):
+            monkeypatch.setattr('app.repositories.redis_repository.time', lambda: 0)
+            await redis.set_all([stale])
+            monkeypatch.setattr('app.repositories.redis_repository.time', lambda: 2)
+            assert get_title(await get()) == 'stale'
+            # there are no bg tasks, so the cache is refreshed at once
+            assert (await redis.get_obj(stale.id)).title == get_obj_from_db.title
+
+    async def test_stale_obj_is_refreshed_in_background(self, get_obj_from_db: d.Model, monkeypatch) -> None:
+        self.base_service.bg_tasks = BackgroundTasks()
+        self.base_service.redis.soft_expire = 1
+        await self.base_service.redis.set_obj(get_obj_from_db)
+        monkeypatch.setattr('app.repositories.redis_repository.time', lambda: 2 ** 40)
+        assert (await self.base_service.get(get_obj_from_db.id)).id == get_obj_from_db.id
+        assert len(self.base_service.bg_tasks.tasks) == 1
+        await self.base_service.bg_tasks()
+
     @pytest.mark.parametrize('method_name', ('get', 'get_or_404'))
     async def test_get_methods_fill_cache(self, method_name, get_obj_from_db):
         assert await self._cache_empty()
         obj_db = await get_method(self.base_service, method_name)(get_obj_from_db.id)
-        assert not await self._cache_empty()
-        await self._check_cache_equals_db()
+        assert await self._cache_empty()
+        await self._check_cached_obj(get_obj_from_db)
         # below is redandance but kept just in case        
         obj_cache = await get_method(self.base_service, method_name)(get_obj_from_db.id)
         compare(obj_db, get_obj_from_db)
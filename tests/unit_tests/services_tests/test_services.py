@@ -1,3 +1,60 @@
+from types import SimpleNamespace
+
+from app.services.services import build_tree
+from tests import conftest as c
+from tests.fixtures import data as d
+
+pytestmark = c.pytest_mark_anyio
+
+
+async def test_submenu_create_refreshes_cached_menu(menu: c.Response,
+                                                    get_menu_service: c.MenuService,
+                                                    get_submenu_service: c.SubmenuService) -> None:
+    menu = await get_menu_service.db.get(d.ID)  # the menu is in the session with submenus_count = 0
+    assert menu.submenus_count == 0
+    await get_submenu_service.create(c.SubmenuIn(**d.SUBMENU_POST_PAYLOAD), extra_data=d.ID)
+    cached = await get_menu_service.redis.get_obj(d.ID)
+    assert (cached.submenus_count, cached.dishes_count) == (1, 0)
+
+
+async def test_dish_create_refreshes_cached_parents(submenu: c.Response,
+                                                    get_menu_service: c.MenuService,
+                                                    get_submenu_service: c.SubmenuService,
+                                                    get_dish_service: c.DishService) -> None:
+    await get_menu_service.db.get(d.ID)
+    await get_submenu_service.db.get(d.ID)
+    await get_dish_service.create(c.DishIn(**d.DISH_POST_PAYLOAD), extra_data=d.ID)
+    assert (await get_menu_service.redis.get_obj(d.ID)).dishes_count == 1
+    assert (await get_submenu_service.redis.get_obj(d.ID)).dishes_count == 1
+
+
+async def test_build_tree() -> None:
+    def row(menu_id, submenu_id=None, dish_id=None):
+        return SimpleNamespace(menu_id=menu_id, menu_title=f'm{menu_id}', menu_description='',
+                               submenu_id=submenu_id, submenu_title=f's{submenu_id}', submenu_description='',
+                               dish_id=dish_id, dish_title=f'd{dish_id}', dish_description='', dish_price=1.5)
+
+    tree = build_tree([row(1, 1, 1), row(1, 1, 2), row(1, 2), row(2)])
+    assert [menu['id'] for menu in tree] == [1, 2]
+    assert [(submenu['id'], submenu['menu_id']) for submenu in tree[0]['submenus']] == [(1, 1), (2, 1)]
+    assert [dish['id'] for dish in tree[0]['submenus'][0]['dishes']] == [1, 2]
+    assert tree[0]['submenus'][1]['dishes'] == []
+    assert tree[1]['submenus'] == []
+
+
+async def test_get_tree_is_cached_until_write(dish: c.Response,
+                                              get_menu_service: c.MenuService,
+                                              get_dish_service: c.DishService,
+                                              sql_statements: list[str]) -> None:
+    etag, body = await get_menu_service.get_tree()
+    assert await get_menu_service.get_tree() == (etag, body)
+    assert len(sql_statements) == 1
+    await get_dish_service.create(c.DishIn(title='New', description='New', price='1'), extra_data=d.ID)
+    new_etag, new_body = await get_menu_service.get_tree()
+    assert new_etag != etag
+    assert b'"New"' in new_body
+
+
 """Not implemented yet."""
 '''
     async def test_create(self, init) -> None:
@@ -1,8 +1,9 @@
 from typing import AsyncGenerator
 
-from aioredis import Redis
+from aioredis import ConnectionPool, Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core import close_redis_pool, get_redis_pool, get_redis_pool_stats, settings
 from ..conftest import get_aioredis, get_async_session, pytest_mark_anyio
 
 pytestmark = pytest_mark_anyio
@@ -17,3 +18,24 @@ async def test_get_async_session() -> None:
 
 async def test_get_aioredis():
     assert isinstance(get_aioredis(), Redis)
+
+
+async def test_get_aioredis_shares_pool() -> None:
+    pool = get_redis_pool()
+    assert isinstance(pool, ConnectionPool)
+    assert pool.max_connections == settings.redis_max_connections
+    assert get_aioredis().connection_pool is pool
+    assert get_aioredis().connection_pool is get_aioredis().connection_pool
+
+
+async def test_close_redis_pool() -> None:
+    pool = get_redis_pool()
+    await close_redis_pool()
+    assert get_redis_pool() is not pool
+
+
+async def test_get_redis_pool_stats() -> None:
+    stats = get_redis_pool_stats()
+    assert stats['max_connections'] == settings.redis_max_connections
+    for key in ('created_connections', 'in_use_connections', 'available_connections'):
+        assert stats[key] >= 0
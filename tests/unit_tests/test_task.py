@@ -1,10 +1,16 @@
 from pathlib import Path
 import pytest
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from sqlalchemy import update
 
 from app.core import db_flush
-from app.celery_tasks.tasks import task
-from app.celery_tasks.utils import fill_repos, is_modified, read_file, init_repos
+from app.services import ENTITIES
+from app.celery_tasks.tasks import get_loop, shutdown_worker, task
+from app.celery_tasks.utils import (
+    CONTENT_HASH_KEY, FILE_HASH_KEY, STARTUP_LOCK_KEY, SYNC_LOCK_KEY, fill_repos, get_content_hash, get_file_hash, init_repos,
+    iter_records, read_file,
+    reconcile_counters, startup_repos, sync_repos, warm_up_cache,
+)
 
 from tests import conftest as c
 from tests.fixtures import data as d
@@ -45,7 +51,7 @@ async def _check_repos(get_menu_service: c.MenuService,
 
 
 
-def write_file(fname: str, edit: bool = False) -> None:
+def write_file(fname: Path, edit: bool = False) -> None:
     wb = load_workbook(filename=fname)
     ws = wb['Лист1']
     if edit:
@@ -64,6 +70,19 @@ def test_read_file() -> None:
     assert menus == d.EXPECTED_MENU_FILE_CONTENT
 
 
+def test_iter_records() -> None:
+    records = iter_records(FAKE_FILE_PATH)
+    assert next(records) == (('Меню',), {'title': 'Меню', 'description': 'Основное меню'})
+    assert next(records)[0] == ('Меню', 'Холодные закуски')
+    assert next(records)[0] == ('Меню', 'Холодные закуски', 'Сельдь Бисмарк')
+    assert len(list(records)) == 15
+
+
+def _changes(stats: dict | str | None) -> tuple[int, int, int]:
+    assert isinstance(stats, dict)
+    return stats['created'], stats['updated'], stats['deleted']
+
+
 @c.pytest_mark_anyio
 async def test_db_flush(dish: c.Response,
                         get_menu_repo: c.MenuRepository,
@@ -91,6 +110,66 @@ async def test_fill_repos(get_menu_service: c.MenuService,
     await _check_repos(get_menu_service, get_submenu_service, get_dish_service)
 
 
+@c.pytest_mark_anyio
+async def test_fill_repos_inserts_each_level_at_once(get_menu_service: c.MenuService,
+                                                     get_submenu_service: c.SubmenuService,
+                                                     get_dish_service: c.DishService,
+                                                     sql_statements: list[str]) -> None:
+    menus, submenus, dishes = read_file(FAKE_FILE_PATH)
+    stats = await fill_repos(menus, get_menu_service, get_submenu_service, get_dish_service)
+    assert stats['rows'] == len(menus) + len(submenus) + len(dishes)
+    assert stats['rows_per_sec'] > 0
+    assert [statement.split()[2] for statement in sql_statements if statement.startswith('INSERT')] == [
+        'menu', 'submenu', 'dish']
+
+
+@c.pytest_mark_anyio
+async def test_sync_repos_applies_changes_only(get_menu_service: c.MenuService,
+                                               get_submenu_service: c.SubmenuService,
+                                               get_dish_service: c.DishService) -> None:
+    services = (get_menu_service, get_submenu_service, get_dish_service)
+    menus, _, _ = read_file(FAKE_FILE_PATH)
+    assert (await sync_repos(iter_records(FAKE_FILE_PATH), *services))['created'] == 18
+    assert _changes(await fill_repos(menus, *services)) == (0, 0, 0)
+    dish_ids = [dish.id for dish in await get_dish_service.db.get_all()]
+    await get_menu_service.redis.set_obj(await get_menu_service.db.get(1))
+    first_submenu = menus[0]['submenus'][0]
+    first_submenu['dishes'][0]['price'] = 1.5
+    deleted_dish = first_submenu['dishes'].pop()
+    first_submenu['dishes'].append({**deleted_dish, 'title': 'New dish'})
+    version = await get_menu_service.catalogue.get_version()
+    assert _changes(await fill_repos(menus, *services)) == (1, 1, 1)
+    # the changes of a synchronization are one catalogue version
+    assert await get_menu_service.catalogue.get_changes(version) == (
+        version + 1, {'menu': ['1'], 'submenu': ['1'], 'dish': [str(dish_ids[0]), str(dish_ids[-1] + 1)]},
+        {'dish': [str(dish_ids[2])]})
+    dishes = await get_dish_service.db.get_all()
+    assert [dish.id for dish in dishes[:-1]] == [id for id in dish_ids if id != dish_ids[2]]
+    assert (await get_dish_service.redis.get_obj(dish_ids[0])).price == '1.5'
+    assert await get_dish_service.redis.get_obj(dish_ids[2]) is None
+    assert (await get_dish_service.redis.get_obj(dishes[-1].id)).title == 'New dish'
+    # the counts of the menu have not changed, the cached menu is kept
+    assert (await get_menu_service.redis.get_obj(1)).dishes_count == 6
+
+
+@c.pytest_mark_anyio
+async def test_sync_repos_loads_changes_once_per_level(get_menu_service: c.MenuService,
+                                                       get_submenu_service: c.SubmenuService,
+                                                       get_dish_service: c.DishService,
+                                                       sql_statements: list[str]) -> None:
+    services = (get_menu_service, get_submenu_service, get_dish_service)
+    menus, _, _ = read_file(FAKE_FILE_PATH)
+    await fill_repos(menus, *services)
+    dishes = menus[0]['submenus'][0]['dishes']
+    dishes.extend({**dishes[0], 'title': f'New dish {i}'} for i in range(5))
+    sql_statements.clear()
+    assert _changes(await fill_repos(menus, *services)) == (5, 0, 0)
+    selects = [statement for statement in sql_statements if statement.startswith('SELECT')]
+    # the tree to diff, then the changed objects with their parents: one query per level each
+    assert len(selects) == 6, selects
+    assert not [select for select in selects if '.id = ?' in select and 'IN' not in select]
+
+
 @c.pytest_mark_anyio
 async def test_init_repos(dish: c.Response,
                           get_test_session: c.AsyncSession,
@@ -98,26 +177,167 @@ async def test_init_repos(dish: c.Response,
                           get_menu_service: c.MenuService,
                           get_submenu_service: c.SubmenuService,
                           get_dish_service: c.DishService) -> None:
-    menus = await init_repos(get_test_session, FAKE_FILE_PATH, c.engine, get_test_redis)
-    assert menus == d.EXPECTED_MENU_FILE_CONTENT
+    stats = await init_repos(get_test_session, FAKE_FILE_PATH, get_test_redis)
+    assert stats['rows'] == 18
+    # the submenu and the dish of the deleted menu go by the cascade
+    assert _changes(stats) == (18, 0, 1)
     await _check_repos(get_menu_service, get_submenu_service, get_dish_service)
 
 
+@c.pytest_mark_anyio
+async def test_init_repos_bumps_catalogue_version(get_test_session: c.AsyncSession,
+                                                  get_test_redis: c.FakeRedis,
+                                                  get_menu_service: c.MenuService) -> None:
+    catalogue = get_menu_service.catalogue
+    version = await catalogue.get_version()
+    await init_repos(get_test_session, FAKE_FILE_PATH, get_test_redis)
+    # the objects created in an empty DB are not logged one by one
+    new_version, changed, _ = await catalogue.get_changes(version)
+    assert new_version == version + 1
+    assert changed is None
+    assert await init_repos(get_test_session, FAKE_FILE_PATH, get_test_redis) is None
+    assert await catalogue.get_version() == new_version
+
+
+@c.pytest_mark_anyio
+async def test_warm_up_cache(get_test_session: c.AsyncSession,
+                             get_test_redis: c.FakeRedis,
+                             get_menu_service: c.MenuService,
+                             get_submenu_service: c.SubmenuService,
+                             get_dish_service: c.DishService) -> None:
+    await init_repos(get_test_session, FAKE_FILE_PATH, get_test_redis)
+    # nothing of an empty DB is cached by the synchronization
+    assert await get_menu_service.redis.get_all() is None
+    versions = [await get_menu_service.versions.get(entity) for entity in ENTITIES]
+    generation = await get_test_redis.get(get_menu_service.response_redis.GENERATION_KEY)
+    stats = await warm_up_cache(get_test_session, get_test_redis)
+    # the same data is cached, the ETags and the cached responses stay valid
+    assert [await get_menu_service.versions.get(entity) for entity in ENTITIES] == versions
+    assert await get_test_redis.get(get_menu_service.response_redis.GENERATION_KEY) == generation
+    assert (stats['menus'], stats['submenus'], stats['dishes']) == (2, 4, 12)
+    menus = await get_menu_service.redis.get_all()
+    assert len(menus) == 2
+    assert len(await get_submenu_service.redis.get_all()) == 4
+    submenus = await get_submenu_service.redis.get_all(parent_id=(menus[0].id,))
+    assert len(submenus) == 2
+    assert len(await get_dish_service.redis.get_all(parent_id=(menus[0].id, submenus[0].id))) == 3
+
+
+@c.pytest_mark_anyio
+async def test_reconcile_counters(dish: c.Response,
+                                  get_test_session: c.AsyncSession,
+                                  get_test_redis: c.FakeRedis,
+                                  get_menu_service: c.MenuService) -> None:
+    await get_test_session.execute(update(c.Menu).values(dishes_count=5))
+    await get_test_session.execute(update(c.Submenu).values(dishes_count=5))
+    await get_test_session.commit()
+    assert await reconcile_counters(get_test_session, get_test_redis) == {'menus': 1, 'submenus': 1}
+    assert (await get_menu_service.redis.get_obj(d.ID)).dishes_count == 1
+    version, menu_version = await get_menu_service.catalogue.get_version(), await get_menu_service.versions.get('menu')
+    assert await reconcile_counters(get_test_session, get_test_redis) == {'menus': 0, 'submenus': 0}
+    # nothing has drifted, nothing is written
+    assert await get_menu_service.catalogue.get_version() == version
+    assert await get_menu_service.versions.get('menu') == menu_version
+
+
 @c.pytest_mark_anyio
 async def test_task(get_test_session, get_test_redis) -> str:
     msg = 'Меню не изменялось. Выход из фоновой задачи...'
-    assert await task(get_test_session, FAKE_FILE_PATH, c.engine) == msg
+    assert (await task(get_test_session, FAKE_FILE_PATH, get_test_redis))['rows'] == 18
+    assert await task(get_test_session, FAKE_FILE_PATH, get_test_redis) == msg
+    # saved again without changes
+    write_file(FAKE_FILE_PATH)
+    assert await task(get_test_session, FAKE_FILE_PATH, get_test_redis) == msg
+    # the menu is renamed: the old one is deleted along with its children, the new one is created
+    write_file(FAKE_FILE_PATH, edit=True)
+    assert _changes(await task(get_test_session, FAKE_FILE_PATH, get_test_redis)) == (9, 0, 1)
     write_file(FAKE_FILE_PATH)
-    assert await task(get_test_session, FAKE_FILE_PATH, c.engine, get_test_redis) == d.EXPECTED_MENU_FILE_CONTENT
 
 
-def test_task_name():
-    assert synchronize.name == 'app.celery_tasks.tasks.synchronize'
+@c.pytest_mark_anyio
+async def test_task_skips_if_locked(get_test_session: c.AsyncSession,
+                                    get_test_redis: c.FakeRedis,
+                                    get_menu_repo: c.MenuRepository) -> None:
+    # the application startup is synchronizing the sheet
+    await get_test_redis.set(SYNC_LOCK_KEY, 'startup')
+    assert await task(get_test_session, FAKE_FILE_PATH, get_test_redis) == 'Меню не изменялось. Выход из фоновой задачи...'
+    assert await get_menu_repo.get_all() is None
+    assert await get_test_redis.get(FILE_HASH_KEY) is None
+    assert await get_test_redis.get(SYNC_LOCK_KEY) == b'startup'
+    await get_test_redis.delete(SYNC_LOCK_KEY)
+    assert _changes(await task(get_test_session, FAKE_FILE_PATH, get_test_redis)) == (18, 0, 0)
+    assert await get_test_redis.get(SYNC_LOCK_KEY) is None
+
+
+@c.pytest_mark_anyio
+async def test_startup_repos(get_test_session: c.AsyncSession, get_test_redis: c.FakeRedis) -> None:
+    async def startup(mode: str) -> dict | None:
+        return await startup_repos(get_test_session, get_test_redis, mode, FAKE_FILE_PATH)
+
+    assert await startup('none') is None
+    assert await get_test_redis.get(FILE_HASH_KEY) is None
+    assert _changes(await startup('seed-if-empty')) == (18, 0, 0)
+    # the DB is not empty
+    assert await startup('seed-if-empty') is None
+    # the sheet has not changed
+    assert await startup('verify') is None
+    assert _changes(await startup('full-reload')) == (0, 0, 0)
+    assert await get_test_redis.get(STARTUP_LOCK_KEY) is None
+
+
+@c.pytest_mark_anyio
+async def test_startup_repos_verify_seeds_empty_db(get_test_session: c.AsyncSession,
+                                                   get_test_redis: c.FakeRedis) -> None:
+    # the DB is recreated while Redis keeps the hashes of the synchronized sheet
+    await get_test_redis.mset({FILE_HASH_KEY: get_file_hash(FAKE_FILE_PATH),
+                               CONTENT_HASH_KEY: get_content_hash(iter_records(FAKE_FILE_PATH))})
+    assert await init_repos(get_test_session, FAKE_FILE_PATH, redis=get_test_redis) is None
+    assert _changes(await startup_repos(get_test_session, get_test_redis, 'verify', FAKE_FILE_PATH)) == (18, 0, 0)
+    assert await startup_repos(get_test_session, get_test_redis, 'verify', FAKE_FILE_PATH) is None
 
 
-'''
-def test_is_modified() -> None:
-    assert not is_modified(FAKE_FILE_PATH)
+@c.pytest_mark_anyio
+async def test_startup_repos_skips_if_locked(get_test_session: c.AsyncSession, get_test_redis: c.FakeRedis) -> None:
+    await get_test_redis.set(STARTUP_LOCK_KEY, 'another worker')
+    assert await startup_repos(get_test_session, get_test_redis, 'full-reload', FAKE_FILE_PATH) is None
+    assert await get_test_redis.get(FILE_HASH_KEY) is None
+    assert await get_test_redis.get(STARTUP_LOCK_KEY) == b'another worker'
+
+
+@pytest.mark.parametrize('rows, message', (
+    ([(None, 1, 'Submenu', 'Submenu description')], 'Row 1: the submenu has no menu.'),
+    ([(1, 'Menu', 'Menu description'), (None, None, 1, 'Dish', 'Dish description', 1)],
+     'Row 2: the dish has no submenu.'),
+))
+def test_iter_records_rejects_orphan_rows(tmp_path: Path, rows: list[tuple], message: str) -> None:
+    fname = tmp_path / 'Menu.xlsx'
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Лист1')
+    for row in rows:
+        ws.append(row)
+    wb.save(fname)
+    with pytest.raises(ValueError, match=message):
+        list(iter_records(fname))
+
+
+def test_content_hash() -> None:
+    content_hash = get_content_hash(iter_records(FAKE_FILE_PATH))
+    write_file(FAKE_FILE_PATH)
+    assert get_content_hash(iter_records(FAKE_FILE_PATH)) == content_hash
+    write_file(FAKE_FILE_PATH, edit=True)
+    assert get_content_hash(iter_records(FAKE_FILE_PATH)) != content_hash
     write_file(FAKE_FILE_PATH)
-    assert is_modified(FAKE_FILE_PATH)
-'''
+
+
+def test_worker_loop_is_reused() -> None:
+    loop = get_loop()
+    assert get_loop() is loop
+    assert not loop.is_closed()
+    shutdown_worker()
+    assert loop.is_closed()
+    assert get_loop() is not loop
+    shutdown_worker()
+
+
+def test_task_name():
+    assert synchronize.name == 'app.celery_tasks.tasks.synchronize'
@@ -1,7 +1,11 @@
+import asyncio
 import typing
+from contextlib import asynccontextmanager
 
+import aioredis
 from deepdiff import DeepDiff
 from fastapi import status
+from pydantic import BaseModel
 
 from tests import conftest as c
 from tests.fixtures import data as d
@@ -92,9 +96,17 @@ def get_method(instance: typing.Any, method_name: str):
     return method
 
 
-def compare(left: c.Base, right: c.Base) -> None:
+def compare(left: c.Base | BaseModel, right: c.Base | BaseModel) -> None:
+    """Objects cached as schemas are compared with ORM objects in the same shape."""
+    if isinstance(left, BaseModel) and not isinstance(right, BaseModel):
+        right = type(left).from_orm(right)
+    elif isinstance(right, BaseModel) and not isinstance(left, BaseModel):
+        left = type(right).from_orm(left)
+
     def _get_attrs(item) -> tuple[str]:
         assert item
+        if isinstance(item, BaseModel):
+            return item.dict()
         item_attrs = vars(item)  # .__dict__
         try:
             item_attrs.pop('_sa_instance_state')
@@ -142,3 +154,40 @@ class CRUD(c.CRUDBaseRepository):
         for key, value in update_data.items():
             setattr(obj, key, value)
         return obj
+
+
+@asynccontextmanager
+async def silent_redis(socket_timeout: float) -> typing.AsyncIterator[aioredis.Redis]:
+    """aioredis client of a server that acknowledges the subscriptions and then stays
+    silent, as Redis does on a channel without messages. Other commands are errors."""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                args = []
+                for _ in range(int(line[1:])):
+                    await reader.readline()
+                    args.append((await reader.readline()).rstrip(b'\r\n'))
+                command = args[0].lower()
+                if command in (b'subscribe', b'unsubscribe'):
+                    for number, channel in enumerate(args[1:], 1):
+                        writer.write(b'*3\r\n$%d\r\n%b\r\n$%d\r\n%b\r\n:%d\r\n'
+                                     % (len(command), command, len(channel), channel, number))
+                elif command == b'ping':
+                    writer.write(b'+PONG\r\n')
+                else:
+                    writer.write(b'-ERR unknown command\r\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    redis = aioredis.Redis(port=server.sockets[0].getsockname()[1], socket_timeout=socket_timeout)
+    try:
+        yield redis
+    finally:
+        await redis.close()
+        server.close()
+        await server.wait_closed()
+